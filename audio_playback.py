@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Persistent PipeWire playback for the voice chatbot
+One long-lived `pw-cat --playback` process per sample rate; TTS chunks are
+written into its stdin back to back, so there is no process start-up or
+stream setup between chunks (no audible gaps). SpeechPipeline runs TTS
+synthesis and playback in separate threads so they overlap.
+decode_mp3_stream() turns MP3 chunks from an online TTS into PCM as they
+arrive, in memory.
+"""
+
+import time
+import queue
+import atexit
+import shutil
+import logging
+import threading
+import subprocess
+from typing import Callable, Iterable, Iterator, Optional
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+BYTES_PER_SAMPLE = 2      # s16
+# pw-cat/PipeWire buffering after the last byte is written (graph quantum + device latency)
+DRAIN_MARGIN_S = 0.15
+DRAIN_POLL_S = 0.02
+CLOSE_TIMEOUT_S = 2.0
+# PCM chunks synthesized ahead of playback (bounds memory when TTS outruns the speaker)
+SYNTH_AHEAD_CHUNKS = 4
+# Streaming MP3 decoder (gTTS/Edge output); reads stdin, writes raw s16 to stdout
+MP3_DECODER = "ffmpeg"
+DECODE_CHUNK_S = 0.25     # PCM is released in frame-aligned chunks of at least this length
+
+_streams = {}
+_pipelines = []
+_streams_lock = threading.Lock()
+_END_TEXT = object()
+
+
+class PlaybackStream:
+    """
+    Gapless s16 playback through a single pw-cat process
+
+    write() queues PCM and returns as soon as the pipe has taken it (the
+    pipe fills up and blocks only when several seconds are already queued).
+    drain() waits until the queued audio has played; cancel() stops at once
+    by killing pw-cat, and the next write() starts a fresh process.
+    Playback position is estimated from the bytes written, since pw-cat
+    reports none.
+
+    Args:
+        rate (int): Sample rate of the PCM that will be written
+        channels (int): Channel count
+        target (str, optional): PipeWire sink (--target), default sink if None
+    """
+
+    def __init__(self, rate: int, channels: int = 1, target: Optional[str] = None):
+        self.rate = rate
+        self.channels = channels
+        self.target = target
+        self.bytes_per_sec = rate * channels * BYTES_PER_SAMPLE
+        self._proc = None
+        self._lock = threading.Lock()
+        self._play_until = 0.0     # estimated wall time when the queued audio ends
+        self._generation = 0       # bumped by cancel(), so writers/drainers can tell
+
+    def _command(self) -> list:
+        cmd = ["pw-cat", "--playback", "-",
+               "--format", "s16",
+               "--rate", str(self.rate),
+               "--channels", str(self.channels)]
+        if self.target:
+            cmd += ["--target", self.target]
+        return cmd
+
+    def _start(self):
+        """Start pw-cat (caller holds the lock)"""
+        if self._proc is not None:
+            self._report_exit(self._proc)
+        self._proc = subprocess.Popen(self._command(), stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._play_until = 0.0
+        metrics.inc("tts.playback.started")
+
+    @staticmethod
+    def _report_exit(proc: subprocess.Popen):
+        try:
+            proc.kill()
+            _, stderr = proc.communicate(timeout=0.5)
+        except Exception:
+            return
+        err = (stderr or b"").decode("utf-8", errors="ignore").strip()
+        if err:
+            print(f"❗ pw-cat playback: {err}")
+
+    def write(self, pcm: bytes) -> bool:
+        """Queue PCM for playback; False if it was cancelled meanwhile or pw-cat keeps failing"""
+        if not pcm:
+            return True
+        for attempt in range(2):
+            with self._lock:
+                if self._proc is None or self._proc.poll() is not None:
+                    self._start()
+                proc, generation = self._proc, self._generation
+                now = time.time()
+                self._play_until = max(self._play_until, now) + len(pcm) / self.bytes_per_sec
+            try:
+                proc.stdin.write(pcm)
+                proc.stdin.flush()
+                return True
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    if generation != self._generation:
+                        return False  # cancel() killed the process under us
+                    if self._proc is proc:
+                        self._report_exit(proc)
+                        self._proc = None
+                metrics.inc("tts.playback.errors")
+                logger.warning(f"pw-cat playback failed ({e}){', restarting' if attempt == 0 else ''}")
+        return False
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything written so far has played; False if cancelled or timed out"""
+        with self._lock:
+            generation = self._generation
+            until = self._play_until + DRAIN_MARGIN_S if self._play_until else 0.0
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            now = time.time()
+            if now >= until:
+                return True
+            if deadline is not None and now >= deadline:
+                return False
+            if generation != self._generation:
+                return False
+            time.sleep(min(DRAIN_POLL_S, until - now))
+
+    def remaining_s(self) -> float:
+        """Estimated seconds of queued audio still to play"""
+        with self._lock:
+            return max(0.0, self._play_until - time.time())
+
+    def cancel(self):
+        """Stop playback immediately, dropping queued audio"""
+        with self._lock:
+            self._generation += 1
+            proc, self._proc = self._proc, None
+            self._play_until = 0.0
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=0.5)
+            except Exception:
+                pass
+            metrics.inc("tts.playback.cancelled")
+
+    def close(self):
+        """Let queued audio finish, then end the pw-cat process"""
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=max(CLOSE_TIMEOUT_S, self.remaining_s() + DRAIN_MARGIN_S))
+        except Exception:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+
+class SpeechPipeline:
+    """
+    Producer/consumer TTS: a synthesis thread feeds a bounded queue that a playback thread drains
+
+    say() queues text and returns at once, so the next sentence is
+    synthesized while the current one plays; wait() blocks until everything
+    queued has been played and returns the audio seconds since the last
+    wait(). cancel() drops queued text and audio and stops playback.
+
+    Args:
+        synthesize: text -> iterator of s16 PCM chunks (e.g. Kokoro's output converted)
+        stream (PlaybackStream): Where the PCM is played
+        max_ahead (int): PCM chunks allowed to wait for playback
+    """
+
+    def __init__(self, synthesize: Callable[[str], Iterator[bytes]], stream: PlaybackStream,
+                 max_ahead: int = SYNTH_AHEAD_CHUNKS):
+        self.synthesize = synthesize
+        self.stream = stream
+        self._texts = queue.Queue()
+        self._audio = queue.Queue(maxsize=max_ahead)
+        self._generation = 0
+        self._pending = 0          # texts said but not fully played yet
+        self._idle = threading.Condition()
+        self._audio_s = 0.0
+        threading.Thread(target=self._synth_loop, daemon=True).start()
+        threading.Thread(target=self._play_loop, daemon=True).start()
+        with _streams_lock:
+            _pipelines.append(self)
+
+    def say(self, text: str):
+        """Queue text to be spoken after anything already queued"""
+        with self._idle:
+            self._pending += 1
+            generation = self._generation
+        self._texts.put((generation, text))
+
+    def wait(self) -> float:
+        """Block until the queued speech has played; returns audio seconds played since the last wait()"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+        self.stream.drain()
+        played, self._audio_s = self._audio_s, 0.0
+        return played
+
+    def cancel(self):
+        """Drop queued text and audio and stop playback now"""
+        with self._idle:
+            self._generation += 1
+            self._pending = 0
+            for q in (self._texts, self._audio):
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+            self._idle.notify_all()
+        self.stream.cancel()
+
+    def _synth_loop(self):
+        while True:
+            generation, text = self._texts.get()
+            if generation != self._generation:
+                continue
+            start = time.time()
+            try:
+                for pcm in self.synthesize(text):
+                    if generation != self._generation:
+                        break
+                    self._audio.put((generation, pcm))  # blocks while max_ahead chunks wait
+                metrics.observe("tts.synth_s", time.time() - start)
+            except Exception as e:
+                print(f"❌ TTS Error: {e}")
+            finally:
+                self._audio.put((generation, _END_TEXT))
+
+    def _play_loop(self):
+        while True:
+            if self._audio.empty() and self._pending and self._audio_s and not self.stream.remaining_s():
+                metrics.inc("tts.underruns")  # the speaker went quiet waiting for synthesis
+            generation, item = self._audio.get()
+            if generation != self._generation:
+                continue
+            if item is _END_TEXT:
+                with self._idle:
+                    if generation == self._generation:
+                        self._pending -= 1
+                        self._idle.notify_all()
+                continue
+            self._audio_s += len(item) / self.stream.bytes_per_sec
+            self.stream.write(item)
+
+
+def have_mp3_decoder() -> bool:
+    return shutil.which(MP3_DECODER) is not None
+
+
+def decode_mp3_stream(chunks: Iterable[bytes], rate: int, channels: int = 1,
+                      chunk_s: float = DECODE_CHUNK_S) -> Iterator[bytes]:
+    """
+    s16 PCM for a stream of MP3 chunks, decoded by ffmpeg as they arrive
+
+    A feeder thread pipes the chunks into ffmpeg while this generator yields
+    the decoded PCM, so playback can start after the first MP3 frames
+    instead of after the whole download. Nothing touches the disk. Errors
+    from the chunk source or the decoder are raised once the decoded audio
+    has been yielded; closing the generator early kills ffmpeg.
+    """
+    cmd = [MP3_DECODER, "-hide_banner", "-loglevel", "error",
+           "-f", "mp3", "-i", "pipe:0",
+           "-f", "s16le", "-ac", str(channels), "-ar", str(rate), "pipe:1"]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                try:
+                    proc.stdin.write(chunk)
+                    proc.stdin.flush()
+                except (OSError, ValueError):
+                    return  # decoder killed (generator closed early)
+        except Exception as e:
+            errors.append(e)  # e.g. the TTS download failed
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    frame = channels * BYTES_PER_SAMPLE
+    block = max(frame, int(rate * chunk_s) * frame)
+    pending = b""
+    try:
+        while True:
+            data = proc.stdout.read1(block)
+            if not data:
+                break
+            pending += data
+            if len(pending) >= block:
+                cut = len(pending) - len(pending) % frame
+                yield pending[:cut]
+                pending = pending[cut:]
+        if len(pending) >= frame:
+            yield pending[:len(pending) - len(pending) % frame]
+        feeder.join()
+        if errors:
+            raise errors[0]
+        if proc.wait() != 0:
+            err = proc.stderr.read().decode("utf-8", errors="ignore").strip()
+            raise RuntimeError(f"{MP3_DECODER} could not decode the MP3 stream: {err}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        for pipe in (proc.stdout, proc.stderr):
+            pipe.close()
+
+
+def get_stream(rate: int, channels: int = 1) -> PlaybackStream:
+    """Shared session stream for a sample rate/channel count (created on first use)"""
+    with _streams_lock:
+        stream = _streams.get((rate, channels))
+        if stream is None:
+            stream = _streams[(rate, channels)] = PlaybackStream(rate, channels)
+        return stream
+
+
+def cancel_all():
+    """Stop every speech pipeline and session stream (e.g. on a pause button)"""
+    with _streams_lock:
+        pipelines = list(_pipelines)
+        streams = list(_streams.values())
+    for pipeline in pipelines:
+        pipeline.cancel()
+    for stream in streams:
+        stream.cancel()
+
+
+@atexit.register
+def close_all():
+    with _streams_lock:
+        streams = list(_streams.values())
+        _streams.clear()
+    for stream in streams:
+        stream.close()
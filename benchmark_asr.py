@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+ASR benchmark for Raspberry Pi 4
+Runs a folder of Vietnamese/English WAV + transcript pairs through the same
+Whisper settings as transcribe_audio() and reports speed, memory and accuracy
+
+Dataset layout (transcript next to each WAV, same name):
+  data/en/hello.wav  data/en/hello.txt
+  data/vi/xin_chao.wav  data/vi/xin_chao.txt
+Language comes from the vi/ or en/ folder, otherwise from the transcript text.
+
+Run:
+  python3 benchmark_asr.py data/
+  python3 benchmark_asr.py data/ --models tiny.en small --compute-types int8 float32 --threads 2 4
+  python3 benchmark_asr.py data/ --vad both          # compare Whisper VAD vs trusted segmentation
+  python3 benchmark_asr.py data/ --json results.json
+"""
+
+import sys
+import re
+import json
+import math
+import time
+import wave
+import argparse
+import resource
+import statistics
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import whisper_asr
+import metrics
+import model_store
+
+DEFAULT_MODELS = ["tiny.en", "small"]
+DEFAULT_COMPUTE_TYPES = ["int8", "int8_float32", "float32"]
+DEFAULT_THREADS = [2, 4]
+DOWNLOAD_ROOT = str(Path.home() / ".cache" / "whisper")
+
+VIETNAMESE_CHARS = re.compile(r'[àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]')
+
+
+# ===== Dataset =====
+def load_dataset(data_dir: Path) -> list:
+    """Collect (wav, reference, language, duration) for every WAV with a transcript"""
+    items = []
+    for wav_path in sorted(data_dir.rglob("*.wav")):
+        txt_path = wav_path.with_suffix(".txt")
+        if not txt_path.exists():
+            print(f"⚠️  No transcript for {wav_path}, skipping")
+            continue
+        reference = txt_path.read_text(encoding="utf-8").strip()
+        parts = {p.lower() for p in wav_path.relative_to(data_dir).parts[:-1]}
+        if "vi" in parts:
+            language = "vi"
+        elif "en" in parts:
+            language = "en"
+        else:
+            language = "vi" if VIETNAMESE_CHARS.search(reference.lower()) else "en"
+        with wave.open(str(wav_path), "rb") as wf:
+            duration = wf.getnframes() / float(wf.getframerate())
+        items.append({
+            "wav": str(wav_path),
+            "reference": reference,
+            "language": language,
+            "duration": duration,
+        })
+    return items
+
+
+# ===== Accuracy =====
+def normalize_text(text: str) -> str:
+    """Lowercase, NFC-normalize and strip punctuation (keeps Vietnamese diacritics)"""
+    text = unicodedata.normalize("NFC", text.lower())
+    text = "".join(c if (c.isalnum() or c.isspace()) else " " for c in text)
+    return " ".join(text.split())
+
+
+def edit_distance(ref: list, hyp: list) -> int:
+    """Levenshtein distance between two token sequences"""
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1]
+
+
+def error_counts(reference: str, hypothesis: str) -> dict:
+    """Word and character edit counts for one utterance"""
+    ref, hyp = normalize_text(reference), normalize_text(hypothesis)
+    return {
+        "word_errors": edit_distance(ref.split(), hyp.split()),
+        "words": len(ref.split()),
+        "char_errors": edit_distance(list(ref.replace(" ", "")), list(hyp.replace(" ", ""))),
+        "chars": len(ref.replace(" ", "")),
+    }
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+# ===== Benchmark run (one config per worker process, so peak RSS is per config) =====
+def run_config(config: dict, items: list) -> dict:
+    """Load one Whisper configuration and transcribe every item with it"""
+    load_start = time.time()
+    model = model_store.load_whisper(
+        config["model"],
+        device="cpu",
+        compute_type=config["compute_type"],
+        cpu_threads=config["threads"],
+        download_root=DOWNLOAD_ROOT
+    )
+    load_s = time.time() - load_start
+
+    latencies, audio_s, totals = [], 0.0, {"word_errors": 0, "words": 0, "char_errors": 0, "chars": 0}
+    samples = []
+    for item in items:
+        start = time.time()
+        segments, _ = model.transcribe(
+            item["wav"],
+            **whisper_asr.transcribe_kwargs(item["language"], trusted_segmentation=config["trusted_segmentation"],
+                                            duration_s=item["duration"])
+        )
+        hypothesis = whisper_asr.collect_text(segments, item["duration"], item["language"])
+        latency = time.time() - start
+
+        counts = error_counts(item["reference"], hypothesis)
+        for key in totals:
+            totals[key] += counts[key]
+        latencies.append(latency)
+        audio_s += item["duration"]
+        samples.append({"wav": item["wav"], "hypothesis": hypothesis, "latency_s": latency})
+
+    decode_s = sum(latencies)
+    return {
+        **config,
+        "utterances": len(items),
+        "load_s": load_s,
+        "audio_s": audio_s,
+        "rtf": decode_s / audio_s if audio_s else 0.0,
+        "p50_s": statistics.median(latencies) if latencies else 0.0,
+        "p95_s": percentile(latencies, 95),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "wer": totals["word_errors"] / totals["words"] if totals["words"] else 0.0,
+        "cer": totals["char_errors"] / totals["chars"] if totals["chars"] else 0.0,
+        "rejected_utterances": metrics.get("asr.rejected_utterances"),
+        # Decode windows cut off by the token budget (whisper_asr.TOKENS_PER_SECOND is too low if > 0)
+        "truncated_segments": metrics.get("asr.truncated_segments"),
+        "samples": samples,
+    }
+
+
+def build_configs(args) -> list:
+    vad_modes = {"whisper": [False], "trusted": [True], "both": [False, True]}[args.vad]
+    return [
+        {"model": m, "compute_type": c, "threads": t, "trusted_segmentation": v}
+        for m in args.models
+        for c in args.compute_types
+        for t in args.threads
+        for v in vad_modes
+    ]
+
+
+def print_table(results: list):
+    print("\n📊 ASR Benchmark Results:")
+    header = f"{'model':10} | {'compute':12} | {'thr':>3} | {'vad':7} | {'RTF':>5} | {'p50':>6} | {'p95':>6} | {'RSS MB':>7} | {'WER':>6} | {'CER':>6} | {'trunc':>5}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['model']:10} | {r['compute_type']:12} | {r['threads']:>3} | ❌ {r['error']}")
+            continue
+        vad = "trusted" if r["trusted_segmentation"] else "whisper"
+        print(f"{r['model']:10} | {r['compute_type']:12} | {r['threads']:>3} | {vad:7} | "
+              f"{r['rtf']:5.2f} | {r['p50_s']:5.2f}s | {r['p95_s']:5.2f}s | {r['peak_rss_mb']:7.0f} | "
+              f"{r['wer']:6.1%} | {r['cer']:6.1%} | {r['truncated_segments']:5.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Whisper ASR settings (RTF, latency, RSS, WER/CER)")
+    parser.add_argument("data_dir", help="Folder of WAV files with same-name .txt transcripts")
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--compute-types", nargs="+", default=DEFAULT_COMPUTE_TYPES)
+    parser.add_argument("--threads", nargs="+", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--vad", choices=["whisper", "trusted", "both"], default="both",
+                        help="Whisper's VAD pass, trusted capture segmentation, or compare both")
+    parser.add_argument("--json", help="Write full results (incl. per-utterance output) to this file")
+    args = parser.parse_args()
+
+    items = load_dataset(Path(args.data_dir))
+    if not items:
+        print(f"❌ No WAV + transcript pairs found in {args.data_dir}")
+        sys.exit(1)
+    langs = sorted({i["language"] for i in items})
+    print(f"🏃 Benchmarking ASR on {len(items)} utterances ({', '.join(langs)})")
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for config in build_configs(args):
+        # English-only models cannot transcribe the Vietnamese clips
+        config_items = [i for i in items if not config["model"].endswith(".en") or i["language"] == "en"]
+        if not config_items:
+            continue
+        vad = "trusted" if config["trusted_segmentation"] else "whisper VAD"
+        print(f"\n⏱️  {config['model']} / {config['compute_type']} / {config['threads']} threads / {vad}...")
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result = pool.submit(run_config, config, config_items).result()
+            print(f"  RTF: {result['rtf']:.2f}, WER: {result['wer']:.1%}")
+        except Exception as e:
+            print(f"  ❌ Failed: {e}")
+            result = {**config, "error": str(e).splitlines()[0] if str(e) else type(e).__name__}
+        results.append(result)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+    else:
+        print("\n" + json.dumps([{k: v for k, v in r.items() if k != "samples"} for r in results],
+                                ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+LLM benchmark for Raspberry Pi 4
+Replays a Vietnamese/English prompt set against each Ollama model with the
+same system prompts and options as generate_response() and reports load time,
+time-to-first-token, tokens/sec, p95 latency and output length
+
+Prompt file: one prompt per line, blank lines and # comments ignored.
+Language comes from the text (Vietnamese diacritics), as in benchmark_asr.py.
+
+Run:
+  python3 benchmark_llm.py
+  python3 benchmark_llm.py --models gemma3:270m qwen2:0.5b --runs 5
+  python3 benchmark_llm.py --prompts prompts.txt --json results.json
+  python3 benchmark_llm.py --host http://192.168.1.20:11434
+  python3 benchmark_llm.py --fake                  # in-process stand-in server (fake_ollama.py)
+"""
+
+import sys
+import re
+import json
+import math
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import ollama_client
+import conversation_memory
+import llm_stream
+
+DEFAULT_MODELS = ["gemma3:270m", "qwen2:0.5b", "tinyllama:1.1b"]
+DEFAULT_RUNS = 3
+
+# Same system prompts as generate_response() in chatbot_vietnamese.py
+SYSTEM_PROMPTS = {
+    "vi": "Bạn là một trợ lý giọng nói hữu ích. Hãy trả lời ngắn gọn (tối đa 2 câu) và tự nhiên bằng tiếng Việt.",
+    "en": "You are a helpful voice assistant. Keep responses concise (max 2 sentences) and conversational in English.",
+}
+
+DEFAULT_PROMPTS = [
+    "Xin chào, bạn khỏe không?",
+    "Hôm nay tôi nên nấu món gì cho bữa tối?",
+    "Giải thích ngắn gọn tại sao bầu trời có màu xanh.",
+    "Kể cho tôi một câu chuyện cười ngắn.",
+    "Hi, how are you today?",
+    "What should I cook for dinner tonight?",
+    "Explain briefly why the sky is blue.",
+    "Tell me a short joke.",
+]
+
+VIETNAMESE_CHARS = re.compile(r'[àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]')
+
+
+# ===== Prompt set =====
+def load_prompts(path: str = None) -> list:
+    """[(prompt, language)] from a file, or the built-in set"""
+    lines = DEFAULT_PROMPTS
+    if path:
+        lines = [line.strip() for line in Path(path).read_text(encoding="utf-8").splitlines()]
+        lines = [line for line in lines if line and not line.startswith("#")]
+    return [(p, "vi" if VIETNAMESE_CHARS.search(p.lower()) else "en") for p in lines]
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+# ===== Benchmark run =====
+def unload(model: str, host: str = None):
+    """Ask Ollama to drop the model from memory (keep_alive=0)"""
+    try:
+        ollama_client.generate(model, prompt="", keep_alive=0, host=host)
+    except Exception:
+        pass
+
+
+def run_prompt(model: str, prompt: str, language: str, options: dict, host: str = None) -> dict:
+    """One streamed chat request, timed on the client side"""
+    messages = [{"role": "system", "content": SYSTEM_PROMPTS[language]},
+                {"role": "user", "content": prompt}]
+    start = time.time()
+    first = None
+    final = {}
+    parts = []
+    for part in ollama_client.chat(model, messages, options, stream=True, host=host):
+        token = part["message"]["content"]
+        if token and first is None:
+            first = time.time()
+        parts.append(token)
+        if part.get("done"):
+            final = part
+    total = time.time() - start
+    eval_count = final.get("eval_count") or 0
+    eval_s = (final.get("eval_duration") or 0) / 1e9
+    reply = "".join(parts).strip()
+    return {
+        "prompt": prompt,
+        "language": language,
+        "reply": reply,
+        "ttft_s": (first or time.time()) - start,
+        "total_s": total,
+        "prompt_eval_count": final.get("prompt_eval_count") or 0,
+        "eval_count": eval_count,
+        "eval_s": eval_s,
+        "reply_words": len(reply.split()),
+    }
+
+
+def summarize(samples: list) -> dict:
+    """TTFT/latency percentiles, decode speed and output length for a list of samples"""
+    ttft = [s["ttft_s"] for s in samples]
+    total = [s["total_s"] for s in samples]
+    tokens = sum(s["eval_count"] for s in samples)
+    eval_s = sum(s["eval_s"] for s in samples)
+    return {
+        "requests": len(samples),
+        "ttft_p50_s": statistics.median(ttft) if ttft else 0.0,
+        "ttft_p95_s": percentile(ttft, 95),
+        "total_p50_s": statistics.median(total) if total else 0.0,
+        "total_p95_s": percentile(total, 95),
+        "tokens_per_s": tokens / eval_s if eval_s else 0.0,
+        "reply_tokens": tokens / len(samples) if samples else 0.0,
+        "reply_words": statistics.mean(s["reply_words"] for s in samples) if samples else 0.0,
+    }
+
+
+def run_model(model: str, prompts: list, runs: int, options: dict, host: str = None,
+              keep_loaded: bool = False) -> dict:
+    """Cold-load one model, then replay every prompt `runs` times"""
+    if not keep_loaded:
+        unload(model, host)
+    loaded = ollama_client.preload(model, options=options, host=host)
+    if loaded is None:
+        raise RuntimeError(f"could not load {model} (is it pulled?)")
+
+    samples = []
+    for prompt, language in prompts:
+        for _ in range(runs):
+            samples.append(run_prompt(model, prompt, language, options, host))
+    if not keep_loaded:
+        unload(model, host)  # free RAM before the next model
+
+    by_language = {lang: summarize([s for s in samples if s["language"] == lang])
+                   for lang in sorted({s["language"] for s in samples})}
+    return {
+        "model": model,
+        "load_s": loaded["load_s"],
+        "warmup_s": loaded["warmup_s"],
+        **summarize(samples),
+        "by_language": by_language,
+        "samples": samples,
+    }
+
+
+def print_table(results: list):
+    print("\n📊 LLM Benchmark Results:")
+    header = (f"{'model':16} | {'lang':4} | {'load':>6} | {'TTFT p50':>8} | {'TTFT p95':>8} | "
+              f"{'total p95':>9} | {'tok/s':>6} | {'out tok':>7} | {'words':>5}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['model']:16} | ❌ {r['error']}")
+            continue
+        rows = [("all", r)] + list(r["by_language"].items())
+        for lang, s in rows:
+            print(f"{r['model']:16} | {lang:4} | {r['load_s']:5.2f}s | {s['ttft_p50_s']:7.2f}s | "
+                  f"{s['ttft_p95_s']:7.2f}s | {s['total_p95_s']:8.2f}s | {s['tokens_per_s']:6.1f} | "
+                  f"{s['reply_tokens']:7.1f} | {s['reply_words']:5.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama models (load time, TTFT, tokens/sec, p95, length)")
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--prompts", help="Prompt file (one per line); default: built-in vi/en set")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Requests per prompt and model")
+    parser.add_argument("--num-predict", type=int, default=llm_stream.response_shape("simple").num_predict,
+                        help="Token limit per reply (default: the bot's budget for simple questions)")
+    parser.add_argument("--host", help="Ollama URL (default: OLLAMA_HOSTS / OLLAMA_HOST as for the bot)")
+    parser.add_argument("--fake", action="store_true", help="Run against an in-process fake_ollama server")
+    parser.add_argument("--keep-loaded", action="store_true",
+                        help="Don't unload models before/after (load time is then the warm reload time)")
+    parser.add_argument("--json", help="Write full results (incl. every reply) to this file")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.prompts)
+    if not prompts:
+        print(f"❌ No prompts found in {args.prompts}")
+        sys.exit(1)
+
+    host = args.host
+    if args.fake:
+        import fake_ollama
+        server, _, host = fake_ollama.start_server(models=args.models)
+        print(f"🤖 Stand-in Ollama on {host}")
+
+    # Same options as generate_response(); num_ctx must match or Ollama reloads the model
+    options = {"temperature": 0.7, "num_predict": args.num_predict, "top_p": 0.9,
+               "num_ctx": conversation_memory.NUM_CTX}
+    langs = sorted({lang for _, lang in prompts})
+    print(f"🏃 Benchmarking {len(args.models)} models on {len(prompts)} prompts ({', '.join(langs)}) "
+          f"x {args.runs} runs")
+
+    results = []
+    for model in args.models:
+        print(f"\n⏱️  {model}...")
+        try:
+            result = run_model(model, prompts, args.runs, options, host, args.keep_loaded)
+            print(f"  TTFT p50: {result['ttft_p50_s']:.2f}s, {result['tokens_per_s']:.1f} tok/s")
+        except Exception as e:
+            print(f"  ❌ Failed: {e}")
+            result = {"model": model, "error": str(e).splitlines()[0] if str(e) else type(e).__name__}
+        results.append(result)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+    else:
+        print("\n" + json.dumps([{k: v for k, v in r.items() if k != "samples"} for r in results],
+                                ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,18 @@ import subprocess
 import wave
 import numpy as np
 from pathlib import Path
-import ollama
-from kokoro import KPipeline
-from faster_whisper import WhisperModel
+import whisper_asr
+import model_store
+import metrics
+import llm_stream
+import conversation_memory
+import response_cache
+import intents
+import speculative_llm
+import ollama_client
+import llm_router
+import audio_playback
+import tts_cache
 import threading
 import spidev as SPI
 
@@ -67,10 +76,16 @@ SILENCE_THRESHOLD = 120   # Base RMS
 END_SILENCE_MS = 800
 MIN_SPEECH_MS = 300
 MAX_RECORDING_MS = 15000
+# Skip Whisper's own VAD and trust the boundaries found above (--trusted-segmentation)
+TRUSTED_SEGMENTATION = whisper_asr.TRUSTED_SEGMENTATION
 
 # Models
 WHISPER_MODEL = "tiny.en"
 LLM_MODEL = "gemma3:270m"
+# Speak the reply sentence by sentence while the LLM is still generating (--no-stream to disable)
+STREAMING_TTS = os.environ.get("STREAMING_TTS", "1") == "1"
+# Start the reply during a pause mid-utterance (--speculative; see speculative_llm.py)
+SPECULATIVE_LLM = speculative_llm.SPECULATIVE_LLM
 TTS_VOICE = "af_heart"
 TTS_SPEED = 1.1
 
@@ -89,6 +104,20 @@ lcd_disp = None
 animation_thread = None
 stop_animation = threading.Event()
 
+# Kokoro synthesis + playback threads (created on first use, see get_speech)
+speech = None
+
+# Conversation history sent with each LLM request (token-budgeted, older turns summarized while idle)
+memory = conversation_memory.ConversationMemory(idle_summarizer=conversation_memory.llm_summarizer(LLM_MODEL))
+
+# Replies to repeated questions (normalized transcript + language + system prompt)
+reply_cache = response_cache.ResponseCache()
+# Complex questions go to llm_router.LARGE_MODEL first (LLM_LARGE_MODEL="" to disable)
+router = llm_router.Router([LLM_MODEL], options={"num_ctx": conversation_memory.NUM_CTX})
+
+# Local commands (goodbye, time/date, repeat, volume, pause/resume) answered without the LLM
+intent_engine = intents.IntentEngine(languages=("en",), disabled=("switch_en", "switch_vi"))
+
 # ===== Pause/Resume Buttons =====
 PAUSE_BUTTON_PIN = 23
 RESUME_BUTTON_PIN = 24
@@ -190,6 +219,7 @@ def show_paused_screen():
 
 def on_pause():
     paused.set()
+    audio_playback.cancel_all()
     stop_speech_animation()
     show_paused_screen()
     print("⏸️  Paused")
@@ -219,7 +249,8 @@ def init_models():
     print("📦 Loading models (this may take a moment the first time)...")
 
     print("  Loading Whisper...")
-    whisper = WhisperModel(
+    # Loads from the local model store (no network) once `model_store.py fetch` has run
+    whisper = model_store.load_whisper(
         WHISPER_MODEL,
         device="cpu",
         compute_type="int8",
@@ -228,15 +259,21 @@ def init_models():
     )
 
     print("  Loading Kokoro TTS...")
-    tts = KPipeline(lang_code='a')
+    tts = model_store.load_kokoro(lang_code='a', voices=[TTS_VOICE])
 
     print("  Checking Ollama...")
     try:
-        ollama.list()
+        installed = ollama_client.list_models()
     except Exception:
         print("❌ Ollama not running! Start it with: sudo systemctl enable --now ollama")
         sys.exit(1)
 
+    router.check_installed(installed)
+
+    print(f"  Preloading {LLM_MODEL} (memory profile: {ollama_client.MEMORY_PROFILE})...")
+    ollama_client.preload_models(LLM_MODEL, options={"num_ctx": conversation_memory.NUM_CTX})
+    router.preload(options={"num_ctx": conversation_memory.NUM_CTX})
+
     print("✅ All models loaded successfully!\n")
     return whisper, tts
 
@@ -298,7 +335,7 @@ def _select_record_pipeline(target):
             print(f"   ⚠️  pw-cat produced no data at {rate}Hz/{ch}ch, retrying...")
     return None, None, None, None, "No working pw-cat configuration found"
 
-def record_with_vad(timeout_seconds=30, stop_button=None):
+def record_with_vad(timeout_seconds=30, stop_button=None, speculator=None):
     """Record audio until silence is detected (VAD). Returns (bytes, rate, channels) or (None, None, None)."""
     print("🎤 Listening... (speak now)")
     if MIC_TARGET:
@@ -312,6 +349,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
     bytes_per_sample = 2
     frame_bytes = int(rate * FRAME_MS / 1000) * bytes_per_sample * ch
     audio_buffer = bytearray()
+    speech_end = 0  # buffer length after the last voiced frame
 
     try:
         # Quick calibration (~300ms)
@@ -331,6 +369,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
         is_speaking = False
         silence_ms = 0
         speech_ms = 0
+        speculated = False
         total_ms = 0
         start = time.time()
 
@@ -343,6 +382,11 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 is_speaking = True
                 speech_ms = FRAME_MS
                 audio_buffer.extend(first_chunk)
+                speech_end = len(audio_buffer)
+
+        # Let the LLM summarize old turns while nobody is talking (stopped at speech onset)
+        if not is_speaking:
+            memory.start_idle_compaction()
 
         while True:
             if check_stop(stop_button):
@@ -369,9 +413,18 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 audio_buffer.extend(chunk)
                 if rms < threshold:
                     silence_ms += FRAME_MS
+                    if (speculator and not speculated and speech_ms >= MIN_SPEECH_MS
+                            and silence_ms >= speculative_llm.SPECULATE_AFTER_SILENCE_MS):
+                        speculator.on_pause(whisper_asr.trim_to_speech(bytes(audio_buffer), speech_end, rate, ch),
+                                            rate, ch)
+                        speculated = True
                 else:
+                    if speculated:
+                        speculator.on_speech_resumed()
+                        speculated = False
                     silence_ms = 0
                     speech_ms += FRAME_MS
+                    speech_end = len(audio_buffer)
 
                 if silence_ms >= END_SILENCE_MS and speech_ms >= MIN_SPEECH_MS:
                     dur_s = len(audio_buffer) / (rate * bytes_per_sample * ch)
@@ -383,9 +436,11 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
             else:
                 if rms > threshold:
                     is_speaking = True
+                    memory.stop_idle_compaction()
                     speech_ms = FRAME_MS
                     silence_ms = 0
                     audio_buffer.extend(chunk)
+                    speech_end = len(audio_buffer)
                     print("\n  💬 Speech detected!")
 
             total_ms += FRAME_MS
@@ -394,6 +449,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
         print("\n  ⏹️  Recording stopped")
         audio_buffer = None
     finally:
+        memory.stop_idle_compaction()
         try:
             proc.terminate(); proc.wait(timeout=0.8)
         except Exception:
@@ -403,6 +459,8 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 pass
 
     if audio_buffer and len(audio_buffer) > 1000:
+        if TRUSTED_SEGMENTATION:
+            audio_buffer = whisper_asr.trim_to_speech(audio_buffer, speech_end, rate, ch)
         return bytes(audio_buffer), rate, ch
     return None, None, None
 
@@ -413,42 +471,57 @@ def save_wav(audio_data, filepath, sample_rate, channels):
         wf.setframerate(sample_rate)
         wf.writeframes(audio_data)
 
-def transcribe_audio(whisper_model, audio_path):
+def transcribe_audio(whisper_model, audio):
+    """Transcript of a WAV path or a 16 kHz float32 array (the speculative partial pass), None if empty"""
     print("🧠 Transcribing...")
     try:
+        duration_s = whisper_asr.audio_duration(audio)
         segments, info = whisper_model.transcribe(
-            str(audio_path),
-            language="en",
-            beam_size=1,
-            best_of=1,
-            temperature=0.0,
-            vad_filter=True,
-            vad_parameters=dict(
-                min_silence_duration_ms=500,
-                speech_pad_ms=200
-            )
+            audio if isinstance(audio, np.ndarray) else str(audio),
+            **whisper_asr.transcribe_kwargs("en", trusted_segmentation=TRUSTED_SEGMENTATION,
+                                            duration_s=duration_s)
         )
-        text = " ".join(seg.text.strip() for seg in segments)
+        # Drops no-speech/low-confidence segments and stops on repeated output
+        text = whisper_asr.collect_text(segments, duration_s, "en")
         return text.strip() if text else None
     except Exception as e:
         print(f"❌ Transcription error: {e}")
         return None
 
-def generate_response(user_text):
+def generate_response_stream(user_text, handle=None):
+    """Yield the reply token by token as the LLM generates it (handle: StreamHandle to abort it)"""
     print("💭 Thinking...")
+    system_msg = "You are a helpful voice assistant. Keep responses concise (max 2 sentences) and conversational."
+    # Follow-ups that may refer to earlier turns are neither cached nor served from the cache;
+    # the key includes the routed model, so switching models does not serve its old replies
+    route = router.route(user_text, "en")
+    model = route.tiers[0][0]
+    has_context = memory.has_context
+    cached = reply_cache.get(user_text, "en", system_msg, has_context, model=model)
+    if cached:
+        print("💾 Cached reply")
+        yield cached
+        return
+
+    parts = []
     try:
-        resp = ollama.chat(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful voice assistant. Keep responses concise (max 2 sentences) and conversational."},
-                {"role": "user", "content": user_text}
-            ],
-            options={"temperature": 0.7, "num_predict": 60, "top_p": 0.9}
-        )
-        return resp["message"]["content"].strip()
+        messages = memory.messages(system_msg, user_text)
+        # Token budget by route and recent decode speed; the reply ends on a complete sentence
+        shape = llm_stream.response_shape(route.name)
+        options = {"temperature": 0.7, "num_predict": shape.num_predict, "top_p": 0.9, "num_ctx": conversation_memory.NUM_CTX}
+        for token in llm_stream.shape_reply(router.stream(route, lambda models: llm_stream.stream_chat_with_fallback(
+            models, messages, options, handle=handle
+        )), shape):
+            parts.append(token)
+            yield token
+        reply_cache.put(user_text, "en", system_msg, "".join(parts).strip(), has_context, model=model)
     except Exception as e:
         print(f"❌ LLM Error: {e}")
-        return "I'm sorry, I had trouble processing that."
+        if not parts:
+            yield "I'm sorry, I had trouble processing that."
+
+def generate_response(user_text):
+    return "".join(generate_response_stream(user_text)).strip()
 
 # ---- TTS utils (Tensor-safe) ----
 def _to_numpy_audio(audio):
@@ -465,41 +538,48 @@ def _to_numpy_audio(audio):
         audio = np.squeeze(audio)
     return audio
 
-def speak_text(tts_pipeline, text):
+def _kokoro_pcm(tts_pipeline, text):
+    """s16 PCM chunks for text, as Kokoro yields them"""
+    for _, _, audio in tts_pipeline(text, voice=TTS_VOICE, speed=TTS_SPEED):
+        audio_np = _to_numpy_audio(audio)
+        yield (np.clip(audio_np, -1.0, 1.0) * 32767.0).astype(np.int16).tobytes()
+
+def get_speech(tts_pipeline):
+    """Session speech pipeline: Kokoro synthesizes the next chunk while the current one plays"""
+    global speech
+    if speech is None:
+        # Use pipeline sample_rate if available; default to 24k.
+        sr = int(getattr(tts_pipeline, "sample_rate", 24000) or 24000)
+        # Repeated phrases come from the on-disk cache instead of Kokoro
+        synthesize = lambda text: tts_cache.cached_pcm("kokoro", TTS_VOICE, TTS_SPEED, text,
+                                                       lambda t: _kokoro_pcm(tts_pipeline, t), sr)
+        # One pw-cat for the whole session: chunks play back to back without gaps
+        speech = audio_playback.SpeechPipeline(synthesize, audio_playback.get_stream(sr))
+    return speech
+
+def speak_text(tts_pipeline, text, wait=True):
+    """Speak text; wait=False only queues it (finish_speaking() waits). Returns audio seconds played."""
     print("🔊 Speaking...")
 
     # Respect pause before starting
     if paused.is_set():
         print("🔇 Skipping TTS (paused)")
-        return
+        return 0.0
 
-    # Start the speech animation
-    start_speech_animation()
+    # Start the speech animation (already running while earlier chunks of a reply play)
+    if not (animation_thread and animation_thread.is_alive()):
+        start_speech_animation()
 
     try:
-        # Use pipeline sample_rate if available; default to 24k.
-        sr = int(getattr(tts_pipeline, "sample_rate", 24000) or 24000)
-        gen = tts_pipeline(text, voice=TTS_VOICE, speed=TTS_SPEED)
-        for _, _, audio in gen:
-            if paused.is_set():
-                print("🔇 TTS interrupted (paused)")
-                break
-            audio_np = _to_numpy_audio(audio)
-            pcm16 = (np.clip(audio_np, -1.0, 1.0) * 32767.0).astype(np.int16).tobytes()
-            play_cmd = [
-                "pw-cat", "--playback", "-",
-                "--format", "s16",
-                "--rate", str(sr),
-                "--channels", "1"
-            ]
-            proc = subprocess.Popen(play_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-            _, stderr = proc.communicate(pcm16)
-            if proc.returncode != 0:
-                err = (stderr or b"").decode("utf-8", errors="ignore").strip()
-                if err:
-                    print(f"❗ pw-cat playback: {err}")
+        get_speech(tts_pipeline).say(text)
     except Exception as e:
         print(f"❌ TTS Error: {e}")
+    return finish_speaking(tts_pipeline) if wait else 0.0
+
+def finish_speaking(tts_pipeline):
+    """Wait until all queued speech has played (the pause button cuts it short); returns audio seconds"""
+    try:
+        return get_speech(tts_pipeline).wait()
     finally:
         # Stop animation and return to resting face
         stop_speech_animation()
@@ -545,8 +625,17 @@ def record_fixed_seconds(seconds=3, stop_button=None):
 
 # ===== Main =====
 def main():
-    global MIC_TARGET, lcd_disp
+    global MIC_TARGET, TRUSTED_SEGMENTATION, STREAMING_TTS, SPECULATIVE_LLM, lcd_disp
     args = sys.argv[1:]
+    if "--trusted-segmentation" in args:
+        TRUSTED_SEGMENTATION = True
+
+    if "--no-stream" in args:
+        STREAMING_TTS = False
+
+    if "--speculative" in args:
+        SPECULATIVE_LLM = True
+
     if "--mic-target" in args:
         try:
             MIC_TARGET = args[args.index("--mic-target") + 1]
@@ -561,6 +650,7 @@ def main():
                 lcd_disp.module_exit()
             except:
                 pass
+        metrics.report()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, shutdown_handler)
@@ -572,6 +662,9 @@ def main():
             print("\nUsage: python3 chatbot.py [--mic-target <id-or-name>] [--test]")
             print("  --mic-target   Force a specific PipeWire source (from `wpctl status`)")
             print("  --test         Record ~3s and play back (quick audio sanity check)")
+            print("  --trusted-segmentation  Skip Whisper's VAD pass (audio is already endpointed)")
+            print("  --no-stream    Wait for the full LLM reply before speaking")
+            print("  --speculative  Start the reply during a pause (second Whisper pass per turn)")
             sys.exit(0)
         elif args[0] == "--test" or "--test" in args:
             stop_button = init_button()
@@ -593,6 +686,11 @@ def main():
     show_sprite(RESTING_SPRITE)
 
     whisper_model, tts_pipeline = init_models()
+    speculator = None
+    if SPECULATIVE_LLM:
+        speculator = speculative_llm.Speculator(
+            lambda pcm, rate, ch: transcribe_audio(whisper_model, whisper_asr.pcm_to_float(pcm, rate, ch)),
+            generate_response_stream)
     stop_button = init_button()
     pause_btn, resume_btn = init_pause_resume_buttons()  # keep refs in scope
 
@@ -627,21 +725,47 @@ def main():
                 print("\n⏹️  Stop button pressed")
                 break
 
-            audio_data, rate, ch = record_with_vad(timeout_seconds=30, stop_button=stop_button)
+            if speculator:
+                speculator.cancel()  # left over from a turn that was never answered
+            audio_data, rate, ch = record_with_vad(timeout_seconds=30, stop_button=stop_button,
+                                                   speculator=None if intent_engine.paused else speculator)
 
             if audio_data:
+                turn_start = time.time()
                 save_wav(audio_data, TEMP_WAV, sample_rate=rate, channels=ch)
-                user_text = transcribe_audio(whisper_model, TEMP_WAV)
+                # The partial pass from the pause already covers the utterance if the speaker
+                # did not resume: wait for it rather than running a second Whisper pass next to it
+                user_text = speculator.transcript() if speculator else None
+                if user_text is None:
+                    user_text = transcribe_audio(whisper_model, TEMP_WAV)
 
                 if user_text:
                     print(f"📝 You said: \"{user_text}\"")
-                    if any(w in user_text.lower() for w in ["goodbye", "bye", "stop", "exit", "quit", "shut down", "turn off"]):
-                        speak_text(tts_pipeline, "Goodbye!")
-                        break
-
-                    reply = generate_response(user_text)
-                    print(f"🤖 Assistant: \"{reply}\"\n")
-                    speak_text(tts_pipeline, reply)
+                    intent = intent_engine.handle(user_text, "en")
+                    if intent:
+                        if speculator:
+                            speculator.cancel()
+                        if intent.reply:
+                            print(f"🤖 Assistant: \"{intent.reply}\"\n")
+                            speak_text(tts_pipeline, intent.reply)
+                        if intent.intent == "goodbye":
+                            break
+                        continue
+
+                    # Reuse the reply started during the pause (its partial transcript was the final one)
+                    tokens = speculator.resolve() if speculator else None
+                    if STREAMING_TTS:
+                        reply = llm_stream.speak_stream(tokens or generate_response_stream(user_text),
+                                                        lambda chunk: speak_text(tts_pipeline, chunk, wait=False),
+                                                        turn_start=turn_start,
+                                                        finish_fn=lambda: finish_speaking(tts_pipeline))
+                        print(f"🤖 Assistant: \"{reply}\"\n")
+                    else:
+                        reply = "".join(tokens).strip() if tokens else generate_response(user_text)
+                        print(f"🤖 Assistant: \"{reply}\"\n")
+                        speak_text(tts_pipeline, reply)
+                    memory.add_turn(user_text, reply)
+                    intent_engine.remember(reply)
 
                     print(f"⏳ Ready again in {AUTO_RESTART_DELAY}s...")
                     time.sleep(AUTO_RESTART_DELAY)
@@ -668,6 +792,7 @@ def main():
             lcd_disp.module_exit()
         except:
             pass
+    metrics.report()
     print("="*50)
 
 if __name__ == "__main__":
@@ -14,6 +14,7 @@ Run:
   python3 chatbot_vietnamese.py --mic-target <source-id-or-name>
   MIC_TARGET=<source-id-or-name> python3 chatbot_vietnamese.py
   python3 chatbot_vietnamese.py --test
+  python3 chatbot_vietnamese.py --trusted-segmentation  # Skip Whisper VAD pass
   python3 chatbot_vietnamese.py --lang vi  # Force Vietnamese
   python3 chatbot_vietnamese.py --lang en  # Force English
 """
@@ -26,8 +27,17 @@ import subprocess
 import wave
 import numpy as np
 from pathlib import Path
-import ollama
-from faster_whisper import WhisperModel
+import whisper_asr
+import model_store
+import metrics
+import llm_stream
+import conversation_memory
+import response_cache
+import intents
+import speculative_llm
+import ollama_client
+import llm_router
+import llm_fallback
 from gtts import gTTS
 import pygame
 import tempfile
@@ -59,11 +69,17 @@ SILENCE_THRESHOLD = 120   # Base RMS
 END_SILENCE_MS = 800
 MIN_SPEECH_MS = 300
 MAX_RECORDING_MS = 15000
+# Skip Whisper's own VAD and trust the boundaries found above (--trusted-segmentation)
+TRUSTED_SEGMENTATION = whisper_asr.TRUSTED_SEGMENTATION
 
 # Models (optimized for Pi 4 8GB)
 WHISPER_MODEL = "small"  # Better Vietnamese support than tiny
 LLM_MODEL = "qwen2:0.5b"  # Lightweight model with better multilingual support
 FALLBACK_LLM_MODEL = "tinyllama:1.1b"
+# Speak the reply sentence by sentence while the LLM is still generating (--no-stream to disable)
+STREAMING_TTS = os.environ.get("STREAMING_TTS", "1") == "1"
+# Start the reply during a pause mid-utterance (--speculative; see speculative_llm.py)
+SPECULATIVE_LLM = speculative_llm.SPECULATIVE_LLM
 
 # Language settings
 DEFAULT_LANGUAGE = "vi"  # Vietnamese by default
@@ -86,6 +102,20 @@ current_language = DEFAULT_LANGUAGE
 # Initialize Vietnamese TTS
 vietnamese_tts = None
 
+# Conversation history sent with each LLM request (token-budgeted, older turns summarized while idle)
+memory = conversation_memory.ConversationMemory(idle_summarizer=conversation_memory.llm_summarizer(LLM_MODEL))
+
+# Replies to repeated questions (normalized transcript + language + system prompt)
+reply_cache = response_cache.ResponseCache()
+
+# Local commands (goodbye, time/date, repeat, volume, pause/resume, language) answered without the LLM
+intent_engine = intents.IntentEngine()
+
+# Remembers primary-model failures and routes straight to FALLBACK_LLM_MODEL for a cool-down
+primary_breaker = llm_fallback.model_breaker(LLM_MODEL, options={"num_ctx": conversation_memory.NUM_CTX})
+# Complex questions go to llm_router.LARGE_MODEL first (LLM_LARGE_MODEL="" to disable)
+router = llm_router.Router([LLM_MODEL, FALLBACK_LLM_MODEL], options={"num_ctx": conversation_memory.NUM_CTX})
+
 # ===== Init =====
 def init_models():
     global vietnamese_tts
@@ -94,7 +124,8 @@ def init_models():
 
     print("  Loading Whisper for Vietnamese...")
     # Use small model for better Vietnamese support
-    whisper = WhisperModel(
+    # Loads from the local model store (no network) once `model_store.py fetch` has run
+    whisper = model_store.load_whisper(
         WHISPER_MODEL,
         device="cpu",
         compute_type="int8",
@@ -107,11 +138,17 @@ def init_models():
 
     print("  Checking Ollama...")
     try:
-        ollama.list()
+        installed = ollama_client.list_models()
     except Exception:
         print("❌ Ollama not running! Start it with: sudo systemctl enable --now ollama")
         sys.exit(1)
 
+    router.check_installed(installed)
+
+    print(f"  Preloading {LLM_MODEL} (memory profile: {ollama_client.MEMORY_PROFILE})...")
+    ollama_client.preload_models(LLM_MODEL, FALLBACK_LLM_MODEL, options={"num_ctx": conversation_memory.NUM_CTX})
+    router.preload(options={"num_ctx": conversation_memory.NUM_CTX})
+
     print("✅ All models loaded successfully!\n")
     print(f"  Available TTS engines: {vietnamese_tts.get_available_engines()}")
     return whisper
@@ -182,7 +219,7 @@ def _select_record_pipeline(target):
             print(f"   ⚠️  pw-cat produced no data at {rate}Hz/{ch}ch, retrying...")
     return None, None, None, None, "No working pw-cat configuration found"
 
-def record_with_vad(timeout_seconds=30, stop_button=None):
+def record_with_vad(timeout_seconds=30, stop_button=None, speculator=None):
     """Record audio until silence is detected (VAD). Returns (bytes, rate, channels) or (None, None, None)."""
     if current_language == "vi":
         print("🎤 Đang lắng nghe... (hãy nói ngay)")
@@ -200,6 +237,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
     bytes_per_sample = 2
     frame_bytes = int(rate * FRAME_MS / 1000) * bytes_per_sample * ch
     audio_buffer = bytearray()
+    speech_end = 0  # buffer length after the last voiced frame
 
     try:
         # Quick calibration (~300ms)
@@ -219,6 +257,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
         is_speaking = False
         silence_ms = 0
         speech_ms = 0
+        speculated = False
         total_ms = 0
         start = time.time()
 
@@ -231,6 +270,11 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 is_speaking = True
                 speech_ms = FRAME_MS
                 audio_buffer.extend(first_chunk)
+                speech_end = len(audio_buffer)
+
+        # Let the LLM summarize old turns while nobody is talking (stopped at speech onset)
+        if not is_speaking:
+            memory.start_idle_compaction()
 
         while True:
             if check_stop(stop_button):
@@ -257,9 +301,18 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 audio_buffer.extend(chunk)
                 if rms < threshold:
                     silence_ms += FRAME_MS
+                    if (speculator and not speculated and speech_ms >= MIN_SPEECH_MS
+                            and silence_ms >= speculative_llm.SPECULATE_AFTER_SILENCE_MS):
+                        speculator.on_pause(whisper_asr.trim_to_speech(bytes(audio_buffer), speech_end, rate, ch),
+                                            rate, ch)
+                        speculated = True
                 else:
+                    if speculated:
+                        speculator.on_speech_resumed()
+                        speculated = False
                     silence_ms = 0
                     speech_ms += FRAME_MS
+                    speech_end = len(audio_buffer)
 
                 if silence_ms >= END_SILENCE_MS and speech_ms >= MIN_SPEECH_MS:
                     dur_s = len(audio_buffer) / (rate * bytes_per_sample * ch)
@@ -271,9 +324,11 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
             else:
                 if rms > threshold:
                     is_speaking = True
+                    memory.stop_idle_compaction()
                     speech_ms = FRAME_MS
                     silence_ms = 0
                     audio_buffer.extend(chunk)
+                    speech_end = len(audio_buffer)
                     if current_language == "vi":
                         print("\n  💬 Phát hiện giọng nói!")
                     else:
@@ -288,6 +343,7 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
             print("\n  ⏹️  Recording stopped")
         audio_buffer = None
     finally:
+        memory.stop_idle_compaction()
         try:
             proc.terminate(); proc.wait(timeout=0.8)
         except Exception:
@@ -297,6 +353,8 @@ def record_with_vad(timeout_seconds=30, stop_button=None):
                 pass
 
     if audio_buffer and len(audio_buffer) > 1000:
+        if TRUSTED_SEGMENTATION:
+            audio_buffer = whisper_asr.trim_to_speech(audio_buffer, speech_end, rate, ch)
         return bytes(audio_buffer), rate, ch
     return None, None, None
 
@@ -307,7 +365,8 @@ def save_wav(audio_data, filepath, sample_rate, channels):
         wf.setframerate(sample_rate)
         wf.writeframes(audio_data)
 
-def transcribe_audio(whisper_model, audio_path):
+def transcribe_audio(whisper_model, audio):
+    """Transcript of a WAV path or a 16 kHz float32 array (the speculative partial pass), None if empty"""
     global current_language
     
     if current_language == "vi":
@@ -319,20 +378,15 @@ def transcribe_audio(whisper_model, audio_path):
         # Auto-detect language if set to auto, otherwise use current language
         language = None if current_language == "auto" else current_language
         
+        duration_s = whisper_asr.audio_duration(audio)
         segments, info = whisper_model.transcribe(
-            str(audio_path),
-            language=language,
-            beam_size=1,
-            best_of=1,
-            temperature=0.0,
-            vad_filter=True,
-            vad_parameters=dict(
-                min_silence_duration_ms=500,
-                speech_pad_ms=200
-            )
+            audio if isinstance(audio, np.ndarray) else str(audio),
+            **whisper_asr.transcribe_kwargs(language, trusted_segmentation=TRUSTED_SEGMENTATION,
+                                            duration_s=duration_s)
         )
         
-        text = " ".join(seg.text.strip() for seg in segments)
+        # Drops no-speech/low-confidence segments and stops on repeated output
+        text = whisper_asr.collect_text(segments, duration_s, language)
         
         # Update current language based on detection if auto mode
         if current_language == "auto" and text:
@@ -344,7 +398,8 @@ def transcribe_audio(whisper_model, audio_path):
         print(f"❌ Transcription error: {e}")
         return None
 
-def generate_response(user_text):
+def generate_response_stream(user_text, handle=None):
+    """Yield the reply token by token (routed model tier, primary then FALLBACK_LLM_MODEL; handle: StreamHandle to abort it)"""
     global current_language
     
     if current_language == "vi":
@@ -352,43 +407,50 @@ def generate_response(user_text):
     else:
         print("💭 Thinking...")
     
+    parts = []
     try:
         # Prepare system message based on language
-        if current_language == "vi" or detect_language(user_text) == "vi":
+        language = "vi" if current_language == "vi" or detect_language(user_text) == "vi" else "en"
+        if language == "vi":
             system_msg = "Bạn là một trợ lý giọng nói hữu ích. Hãy trả lời ngắn gọn (tối đa 2 câu) và tự nhiên bằng tiếng Việt."
         else:
             system_msg = "You are a helpful voice assistant. Keep responses concise (max 2 sentences) and conversational in English."
         
-        # Try primary model first
-        try:
-            resp = ollama.chat(
-                model=LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_text}
-                ],
-                options={"temperature": 0.7, "num_predict": 60, "top_p": 0.9}
-            )
-            return resp["message"]["content"].strip()
-        except Exception:
-            # Fallback to secondary model
-            print(f"⚠️ Trying fallback model: {FALLBACK_LLM_MODEL}")
-            resp = ollama.chat(
-                model=FALLBACK_LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_text}
-                ],
-                options={"temperature": 0.7, "num_predict": 60, "top_p": 0.9}
-            )
-            return resp["message"]["content"].strip()
+        # Follow-ups that may refer to earlier turns are neither cached nor served from the cache;
+        # the key includes the routed model, so switching models does not serve its old replies
+        route = router.route(user_text, language)
+        model = route.tiers[0][0]
+        has_context = memory.has_context
+        cached = reply_cache.get(user_text, current_language, system_msg, has_context, model=model)
+        if cached:
+            print("💾 Cached reply")
+            yield cached
+            return
+        
+        messages = memory.messages(system_msg, user_text)
+        # Token budget by route and recent decode speed; the reply ends on a complete sentence
+        shape = llm_stream.response_shape(route.name)
+        options = {"temperature": 0.7, "num_predict": shape.num_predict, "top_p": 0.9, "num_ctx": conversation_memory.NUM_CTX}
+        # Within a tier the primary model goes first (unless its breaker is open); the fallback starts
+        # if the primary fails or misses its first-token budget, and whichever streams first is used
+        for token in llm_stream.shape_reply(router.stream(route, lambda models: llm_fallback.hedged_stream(
+            models, messages=messages, options=options, breakers={LLM_MODEL: primary_breaker}, handle=handle
+        )), shape):
+            parts.append(token)
+            yield token
+        reply_cache.put(user_text, current_language, system_msg, "".join(parts).strip(), has_context, model=model)
             
     except Exception as e:
         print(f"❌ LLM Error: {e}")
+        if parts:
+            return
         if current_language == "vi":
-            return "Xin lỗi, tôi gặp sự cố khi xử lý yêu cầu đó."
+            yield "Xin lỗi, tôi gặp sự cố khi xử lý yêu cầu đó."
         else:
-            return "I'm sorry, I had trouble processing that."
+            yield "I'm sorry, I had trouble processing that."
+
+def generate_response(user_text):
+    return "".join(generate_response_stream(user_text)).strip()
 
 def speak_text_vietnamese(text):
     """Advanced Vietnamese TTS using multiple engines"""
@@ -481,10 +543,19 @@ def record_fixed_seconds(seconds=3, stop_button=None):
 
 # ===== Main =====
 def main():
-    global MIC_TARGET, current_language
+    global MIC_TARGET, TRUSTED_SEGMENTATION, STREAMING_TTS, SPECULATIVE_LLM, current_language
     args = sys.argv[1:]
     
     # Parse command line arguments
+    if "--trusted-segmentation" in args:
+        TRUSTED_SEGMENTATION = True
+
+    if "--no-stream" in args:
+        STREAMING_TTS = False
+
+    if "--speculative" in args:
+        SPECULATIVE_LLM = True
+
     if "--mic-target" in args:
         try:
             MIC_TARGET = args[args.index("--mic-target") + 1]
@@ -506,6 +577,7 @@ def main():
             print("\n\n👋 Đang tắt...")
         else:
             print("\n\n👋 Shutting down...")
+        metrics.report()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, shutdown_handler)
@@ -518,6 +590,9 @@ def main():
             print("  --mic-target <id>   Force a specific PipeWire source")
             print("  --lang <vi|en|auto> Set language (vi=Vietnamese, en=English, auto=detect)")
             print("  --test              Record and play back test audio")
+            print("  --trusted-segmentation  Skip Whisper's VAD pass (audio is already endpointed)")
+            print("  --no-stream         Wait for the full LLM reply before speaking")
+            print("  --speculative       Start the reply during a pause (second Whisper pass per turn)")
             sys.exit(0)
         elif args[0] == "--test" or "--test" in args:
             stop_button = init_button()
@@ -536,6 +611,11 @@ def main():
             sys.exit(0)
 
     whisper_model = init_models()
+    speculator = None
+    if SPECULATIVE_LLM:
+        speculator = speculative_llm.Speculator(
+            lambda pcm, rate, ch: transcribe_audio(whisper_model, whisper_asr.pcm_to_float(pcm, rate, ch)),
+            generate_response_stream)
     stop_button = init_button()
 
     print("\n" + "="*60)
@@ -567,11 +647,19 @@ def main():
                     print("\n⏹️  Stop button pressed")
                 break
 
-            audio_data, rate, ch = record_with_vad(timeout_seconds=30, stop_button=stop_button)
+            if speculator:
+                speculator.cancel()  # left over from a turn that was never answered
+            audio_data, rate, ch = record_with_vad(timeout_seconds=30, stop_button=stop_button,
+                                                   speculator=None if intent_engine.paused else speculator)
 
             if audio_data:
+                turn_start = time.time()
                 save_wav(audio_data, TEMP_WAV, sample_rate=rate, channels=ch)
-                user_text = transcribe_audio(whisper_model, TEMP_WAV)
+                # The partial pass from the pause already covers the utterance if the speaker
+                # did not resume: wait for it rather than running a second Whisper pass next to it
+                user_text = speculator.transcript() if speculator else None
+                if user_text is None:
+                    user_text = transcribe_audio(whisper_model, TEMP_WAV)
 
                 if user_text:
                     if current_language == "vi":
@@ -579,25 +667,38 @@ def main():
                     else:
                         print(f"📝 You said: \"{user_text}\"")
                     
-                    # Check for goodbye in both languages
-                    goodbye_words_vi = ["tạm biệt", "chào nhé", "dừng lại", "tắt đi", "kết thúc"]
-                    goodbye_words_en = ["goodbye", "bye", "stop", "exit", "quit", "shut down", "turn off"]
-                    
-                    user_lower = user_text.lower()
-                    if (any(w in user_lower for w in goodbye_words_vi) or 
-                        any(w in user_lower for w in goodbye_words_en)):
-                        if current_language == "vi" or detect_language(user_text) == "vi":
-                            speak_text_vietnamese("Tạm biệt!")
-                        else:
-                            speak_text_vietnamese("Goodbye!")
-                        break
-
-                    reply = generate_response(user_text)
+                    # Local commands first (goodbye, time/date, repeat, volume, pause/resume, language)
+                    intent = intent_engine.handle(user_text, current_language)
+                    if intent:
+                        if speculator:
+                            speculator.cancel()
+                        if intent.intent in ("switch_en", "switch_vi"):
+                            current_language = intent.language
+                        if intent.reply:
+                            if current_language == "vi":
+                                print(f"🤖 Tiến Minh: \"{intent.reply}\"\n")
+                            else:
+                                print(f"🤖 Assistant: \"{intent.reply}\"\n")
+                            speak_text_vietnamese(intent.reply)
+                        if intent.intent == "goodbye":
+                            break
+                        continue
+
+                    # Reuse the reply started during the pause (its partial transcript was the final one)
+                    tokens = speculator.resolve() if speculator else None
+                    if STREAMING_TTS:
+                        reply = llm_stream.speak_stream(tokens or generate_response_stream(user_text), speak_text_vietnamese,
+                                                        turn_start=turn_start)
+                    else:
+                        reply = "".join(tokens).strip() if tokens else generate_response(user_text)
                     if current_language == "vi":
                         print(f"🤖 Tiến Minh: \"{reply}\"\n")
                     else:
                         print(f"🤖 Assistant: \"{reply}\"\n")
-                    speak_text_vietnamese(reply)
+                    if not STREAMING_TTS:
+                        speak_text_vietnamese(reply)
+                    memory.add_turn(user_text, reply)
+                    intent_engine.remember(reply)
 
                     if current_language == "vi":
                         print(f"⏳ Sẵn sàng lại sau {AUTO_RESTART_DELAY}s...")
@@ -639,6 +740,7 @@ def main():
         print("\n👋 Tạm biệt!")
     else:
         print("\n👋 Goodbye!")
+    metrics.report()
     print("="*60)
 
 if __name__ == "__main__":
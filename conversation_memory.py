@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Token-budgeted conversation memory for the voice chatbot
+Keeps recent turns verbatim within a token budget and folds older turns into a
+short summary, laid out so Ollama can reuse its prompt cache between turns.
+While the bot waits for speech, older turns can be summarized by the LLM.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import metrics
+import ollama_client
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Tokens of verbatim history sent with each request (0 disables memory)
+MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", "768"))
+# When over budget, compact down to this fraction of it. Compacting in one big
+# step (instead of dropping one turn per request) keeps the prompt prefix
+# unchanged for several turns, so Ollama's prompt cache stays valid.
+COMPACT_TO = 0.5
+SUMMARY_TOKEN_BUDGET = 160
+SUMMARY_LINE_CHARS = 120
+# Fixed context window; changing num_ctx between requests reloads the model
+NUM_CTX = int(os.environ.get("LLM_NUM_CTX", "2048"))
+
+BYTES_PER_TOKEN = 4  # UTF-8 bytes per token; Vietnamese diacritics count as 2-3 bytes
+
+# Idle-time LLM summarization: once verbatim history passes IDLE_COMPACT_AT of
+# the budget, fold it down to IDLE_COMPACT_TO while the bot waits for speech.
+# Folding well below the trigger keeps the summary (and the prompt prefix)
+# unchanged for several turns.
+IDLE_COMPACT_AT = 0.6
+IDLE_COMPACT_TO = 0.25
+IDLE_DELAY_S = 1.0   # let the previous reply's audio and the mic settle first
+SUMMARY_PROMPT = ("Summarize this conversation in at most 3 short lines, one fact per line. "
+                  "Keep names, numbers and anything the user asked to remember. "
+                  "Write in the language of the conversation. Output only the lines.")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count that works for both English and Vietnamese"""
+    return max(1, len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+
+
+def _first_sentence(text: str, limit: int = SUMMARY_LINE_CHARS) -> str:
+    text = " ".join(text.split())
+    for i, ch in enumerate(text):
+        if ch in ".!?…" and i >= 8:
+            text = text[:i + 1]
+            break
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def summarize_turns(turns: list) -> list:
+    """Default compressor: one short line per turn (first sentence of each side)"""
+    return [f"User: {_first_sentence(u)} / Assistant: {_first_sentence(a)}" for u, a in turns]
+
+
+def llm_summarizer(model: str, options: Optional[dict] = None) -> Callable:
+    """
+    Summarizer for ConversationMemory(idle_summarizer=...) backed by an Ollama model
+
+    The returned function(summary_lines, turns, handle) merges the existing
+    summary and the turns into new summary lines, or returns None if the
+    request was cancelled through handle (an ollama_client.StreamHandle,
+    which aborts it even during prompt eval, so Ollama stops at once).
+    """
+    def summarize(summary: list, turns: list, handle: ollama_client.StreamHandle) -> Optional[list]:
+        transcript = [f"Earlier: {line}" for line in summary]
+        for u, a in turns:
+            transcript += [f"User: {u}", f"Assistant: {a}"]
+        stream = ollama_client.chat(
+            model,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                      {"role": "user", "content": "\n".join(transcript)}],
+            options={"temperature": 0.2, "num_predict": SUMMARY_TOKEN_BUDGET, "num_ctx": NUM_CTX,
+                     **(options or {})},
+            stream=True,
+            handle=handle,
+        )
+        parts = []
+        try:
+            for part in stream:
+                parts.append(part["message"]["content"])
+        finally:
+            stream.close()
+        if handle.cancelled:
+            return None
+        lines = [line.strip(" -•*\t") for line in "".join(parts).splitlines()]
+        return [line for line in lines if line] or None
+
+    return summarize
+
+
+class ConversationMemory:
+    """
+    Recent turns plus a rolling summary of older ones
+
+    The request is laid out as [system + summary] [old turns ...] [new user
+    message]. Between compactions every request starts with the previous
+    request's prompt, so Ollama only evaluates the newly added tokens (see
+    the llm.prompt_eval_count metric).
+
+    With an idle_summarizer (see llm_summarizer), start_idle_compaction() /
+    stop_idle_compaction() bracket the time spent waiting for speech, so the
+    LLM folds older turns while it would otherwise sit unused and the
+    foreground request never pays for summarization.
+    """
+
+    def __init__(self, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 summarizer: Optional[Callable[[list], list]] = None,
+                 idle_summarizer: Optional[Callable[[list, list, ollama_client.StreamHandle], Optional[list]]] = None):
+        self.token_budget = token_budget
+        self.summarizer = summarizer or summarize_turns
+        self.idle_summarizer = idle_summarizer
+        self.turns = []       # [(user_text, reply)]
+        self.summary = []     # summary lines, oldest first
+        self._lock = threading.Lock()
+        self._idle_cancel = None
+        self._idle_stream = None   # StreamHandle of the in-flight summary request
+
+    @property
+    def enabled(self) -> bool:
+        return self.token_budget > 0
+
+    @property
+    def has_context(self) -> bool:
+        """True once there are earlier turns (or a summary) the next reply may depend on"""
+        with self._lock:
+            return bool(self.turns or self.summary)
+
+    def _turn_tokens(self) -> int:
+        return sum(estimate_tokens(u) + estimate_tokens(a) for u, a in self.turns)
+
+    def _fold_count(self, target: int) -> int:
+        """Number of oldest turns to fold so the rest fit in target (the newest turn is always kept)"""
+        tokens = self._turn_tokens()
+        n = 0
+        while n < len(self.turns) - 1 and tokens > target:
+            u, a = self.turns[n]
+            tokens -= estimate_tokens(u) + estimate_tokens(a)
+            n += 1
+        return n
+
+    def _trim_summary(self):
+        while len(self.summary) > 1 and sum(estimate_tokens(s) for s in self.summary) > SUMMARY_TOKEN_BUDGET:
+            self.summary.pop(0)
+
+    def messages(self, system_msg: str, user_text: str) -> list:
+        """Chat messages for the next request"""
+        with self._lock:
+            if self.summary:
+                system_msg = f"{system_msg}\n\nEarlier in this conversation:\n" + "\n".join(
+                    f"- {line}" for line in self.summary)
+            messages = [{"role": "system", "content": system_msg}]
+            for u, a in self.turns:
+                messages.append({"role": "user", "content": u})
+                messages.append({"role": "assistant", "content": a})
+        messages.append({"role": "user", "content": user_text})
+        return messages
+
+    def add_turn(self, user_text: str, reply: str):
+        """Remember a finished turn, compacting older history when over budget"""
+        if not self.enabled or not reply:
+            return
+        with self._lock:
+            self.turns.append((user_text, reply))
+            if self._turn_tokens() > self.token_budget:
+                self._compact()
+
+    def _compact(self):
+        n = self._fold_count(int(self.token_budget * COMPACT_TO))
+        if not n:
+            return
+        old = self.turns[:n]
+        del self.turns[:n]
+        self.summary.extend(self.summarizer(old))
+        self._trim_summary()
+        logger.info(f"🧠 Compacted {len(old)} turns into the summary ({len(self.turns)} kept verbatim)")
+
+    # ===== Idle-time summarization =====
+    def start_idle_compaction(self):
+        """Fold older turns in the background if history is getting long (call when waiting for speech)"""
+        if not self.enabled or not self.idle_summarizer:
+            return
+        with self._lock:
+            if self._idle_cancel is not None or self._turn_tokens() <= self.token_budget * IDLE_COMPACT_AT:
+                return
+            cancel = self._idle_cancel = threading.Event()
+            handle = self._idle_stream = ollama_client.StreamHandle()
+        threading.Thread(target=self._idle_compact, args=(cancel, handle), daemon=True).start()
+
+    def stop_idle_compaction(self):
+        """
+        Cancel a running idle compaction (call at speech onset, so the LLM is free for the reply)
+
+        The summary request is aborted even if Ollama is still evaluating
+        its prompt, so the next reply does not queue behind it.
+        """
+        with self._lock:
+            cancel, self._idle_cancel = self._idle_cancel, None
+            handle, self._idle_stream = self._idle_stream, None
+        if cancel:
+            cancel.set()
+        if handle:
+            handle.cancel()
+
+    def _idle_compact(self, cancel: threading.Event, handle: ollama_client.StreamHandle):
+        try:
+            if cancel.wait(IDLE_DELAY_S):
+                return
+            with self._lock:
+                old = self.turns[:self._fold_count(int(self.token_budget * IDLE_COMPACT_TO))]
+                summary = list(self.summary)
+            if not old:
+                return
+            start = time.time()
+            lines = self.idle_summarizer(summary, old, handle)
+            if not lines or cancel.is_set():
+                metrics.inc("memory.idle_summary.cancelled")
+                return
+            with self._lock:
+                if self.turns[:len(old)] != old:
+                    return  # cleared or compacted in the foreground meanwhile
+                del self.turns[:len(old)]
+                self.summary = lines
+                self._trim_summary()
+            metrics.inc("memory.idle_summary.done")
+            metrics.observe("memory.idle_summary_s", time.time() - start)
+            logger.info(f"🧠 Summarized {len(old)} turns while idle ({len(self.turns)} kept verbatim)")
+        except Exception as e:
+            metrics.inc("memory.idle_summary.failed")
+            logger.warning(f"Idle summarization failed: {e}")
+        finally:
+            with self._lock:
+                if self._idle_cancel is cancel:
+                    self._idle_cancel = None
+                    self._idle_stream = None
+
+    def clear(self):
+        """Forget everything (e.g. after a goodbye)"""
+        with self._lock:
+            self.turns.clear()
+            self.summary.clear()
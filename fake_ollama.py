@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Stand-in Ollama server for deterministic LLM benchmarking and testing
+Implements /api/chat, /api/generate and /api/tags with configurable
+time-to-first-token, tokens/sec, model load time, prompt caching, streaming
+and failure injection, so the conversation loop can be measured without
+real models
+
+Run:
+  python3 fake_ollama.py                                  # http://127.0.0.1:11435
+  python3 fake_ollama.py --ttft 0.8 --tokens-per-sec 8 --load-time 5
+  python3 fake_ollama.py --fail-rate 0.2 --slow-models qwen2:0.5b=3.0
+  OLLAMA_HOST=http://127.0.0.1:11435 python3 chatbot_vietnamese.py
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import select
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+DEFAULT_PORT = 11435
+DEFAULT_MODELS = ["qwen2:0.5b", "tinyllama:1.1b", "gemma3:270m"]
+DEFAULT_TTFT_S = 0.3
+DEFAULT_TOKENS_PER_SEC = 10.0
+DEFAULT_PROMPT_TOKENS_PER_SEC = 200.0
+DEFAULT_KEEP_ALIVE_S = 300.0
+BYTES_PER_TOKEN = 4
+
+REPLIES = {
+    "vi": [
+        "Xin chào! Tôi có thể giúp gì cho bạn hôm nay?",
+        "Đó là một câu hỏi hay. Hà Nội là thủ đô của Việt Nam, nổi tiếng với phố cổ và hồ Hoàn Kiếm.",
+        "Tôi hiểu rồi. Bạn có muốn tôi giải thích thêm không?",
+        "Phở là món ăn truyền thống của Việt Nam, thường được ăn vào buổi sáng.",
+    ],
+    "en": [
+        "Hello! How can I help you today?",
+        "That's a good question. The Raspberry Pi is a small, affordable computer, popular for learning and projects.",
+        "I see. Would you like me to explain a bit more?",
+        "Sure, here is a short answer. Keep it simple and try again if anything is unclear.",
+    ],
+}
+VIETNAMESE_CHARS = re.compile(r"[àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]")
+
+
+def _parse_duration(value, default: float) -> float:
+    """Ollama keep_alive ("5m", "30s", "1h", seconds, -1 = forever) to seconds"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    m = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", str(value).strip())
+    if not m:
+        return default
+    number = float(m.group(1))
+    if number < 0:
+        return float("inf")
+    return number * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[m.group(2)]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+
+
+class FakeOllama:
+    """
+    Simulated Ollama state shared by all request handlers
+
+    Timing per request: load_time if the model is not loaded (or its
+    keep_alive expired), prompt evaluation for the tokens not covered by the
+    previous prompt of that model (Ollama's prompt cache), then ttft, then
+    one token every 1/tokens_per_sec seconds. Replies are picked
+    deterministically from the last user message.
+    """
+
+    def __init__(self, models: Optional[list] = None, ttft_s: float = DEFAULT_TTFT_S,
+                 tokens_per_sec: float = DEFAULT_TOKENS_PER_SEC,
+                 prompt_tokens_per_sec: float = DEFAULT_PROMPT_TOKENS_PER_SEC,
+                 load_time_s: float = 0.0, fail_rate: float = 0.0, midstream_fail_rate: float = 0.0,
+                 stall_rate: float = 0.0, slow_models: Optional[dict] = None,
+                 missing_models: Optional[list] = None, seed: int = 0, reply: Optional[str] = None):
+        self.models = list(models or DEFAULT_MODELS)
+        self.ttft_s = ttft_s
+        self.tokens_per_sec = tokens_per_sec
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.load_time_s = load_time_s
+        self.fail_rate = fail_rate
+        self.midstream_fail_rate = midstream_fail_rate
+        self.stall_rate = stall_rate
+        self.slow_models = dict(slow_models or {})      # model -> extra TTFT seconds
+        self.missing_models = set(missing_models or [])
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.loaded_until = {}     # model -> expiry time
+        self.last_prompt = {}      # model -> last prompt text (prompt cache)
+        self.requests = 0
+        self.active = 0
+        self.lock = threading.Lock()
+
+    # ----- simulation -----
+    def _roll(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def _load(self, model: str, keep_alive) -> float:
+        """Seconds spent loading the model for this request"""
+        now = time.time()
+        with self.lock:
+            loaded = self.loaded_until.get(model, 0) > now
+            self.loaded_until[model] = now + _parse_duration(keep_alive, DEFAULT_KEEP_ALIVE_S)
+            if not loaded:
+                self.last_prompt.pop(model, None)
+        return 0.0 if loaded else self.load_time_s
+
+    def _prompt_eval(self, model: str, prompt: str) -> tuple:
+        """(tokens evaluated, total prompt tokens) given the model's previous prompt"""
+        with self.lock:
+            previous = self.last_prompt.get(model, "")
+            self.last_prompt[model] = prompt
+        common = 0
+        for a, b in zip(previous, prompt):
+            if a != b:
+                break
+            common += 1
+        total = estimate_tokens(prompt)
+        return max(1, total - (estimate_tokens(prompt[:common]) if common else 0)), total
+
+    def reply_tokens(self, user_text: str, num_predict: Optional[int]) -> list:
+        if self.reply is not None:
+            text = self.reply
+        else:
+            lang = "vi" if VIETNAMESE_CHARS.search(user_text.lower()) else "en"
+            index = int(hashlib.sha1(user_text.encode("utf-8")).hexdigest(), 16) % len(REPLIES[lang])
+            text = REPLIES[lang][index]
+        words = text.split(" ")
+        tokens = [words[0]] + [" " + w for w in words[1:]]
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+        return tokens
+
+    def tags(self) -> dict:
+        return {"models": [{
+            "name": m,
+            "model": m,
+            "modified_at": "2024-01-01T00:00:00Z",
+            "size": 500_000_000,
+            "digest": hashlib.sha256(m.encode()).hexdigest(),
+            "details": {"format": "gguf", "family": m.split(":")[0], "parameter_size": m.split(":")[-1],
+                        "quantization_level": "Q4_0"},
+        } for m in self.models if m not in self.missing_models]}
+
+
+# ===== HTTP =====
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: FakeOllama = None
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _wait(self, seconds: float):
+        """Sleep for simulated work; like Ollama, give up as soon as the client disconnects"""
+        deadline = time.time() + seconds
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            readable, _, _ = select.select([self.connection], [], [], min(remaining, 0.05))
+            if readable:
+                try:
+                    data = self.connection.recv(1, socket.MSG_PEEK)
+                except OSError:
+                    data = b""
+                if not data:
+                    raise ConnectionResetError("client disconnected")
+                time.sleep(min(remaining, 0.05))  # pipelined request bytes, not a disconnect
+
+    def _write_chunk(self, body: dict):
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json(200, self.state.tags())
+        elif self.path in ("/", ""):
+            data = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        with self.state.lock:
+            self.state.requests += 1
+            self.state.active += 1
+        try:
+            self._generate(req, chat=path == "/api/chat")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled (e.g. the losing side of a hedged request)
+        finally:
+            with self.state.lock:
+                self.state.active -= 1
+
+    def _generate(self, req: dict, chat: bool):
+        state = self.state
+        model = req.get("model", "")
+        if model not in state.models or model in state.missing_models:
+            self._send_json(404, {"error": f"model '{model}' not found, try pulling it first"})
+            return
+        if state._roll(state.fail_rate):
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        options = req.get("options") or {}
+        if chat:
+            messages = req.get("messages") or []
+            prompt = "\n".join(f"{m.get('role')}: {m.get('content', '')}" for m in messages)
+            user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        else:
+            prompt = (req.get("system") or "") + "\n" + (req.get("prompt") or "")
+            user_text = req.get("prompt") or ""
+        stream = req.get("stream", True)
+
+        start = time.time()
+        load_s = state._load(model, req.get("keep_alive"))
+        if (chat and not messages) or (not chat and not user_text):
+            # Empty request: load only (used by preload)
+            time.sleep(load_s)
+            body = {"model": model, "created_at": _now(), "done": True, "done_reason": "load",
+                    "load_duration": int(load_s * 1e9)}
+            body.update({"message": {"role": "assistant", "content": ""}} if chat else {"response": ""})
+            self._send_json(200, body)
+            return
+
+        evaluated, _ = state._prompt_eval(model, prompt)
+        prompt_eval_s = evaluated / state.prompt_tokens_per_sec
+        ttft = load_s + prompt_eval_s + state.ttft_s + state.slow_models.get(model, 0.0)
+        tokens = state.reply_tokens(user_text, options.get("num_predict"))
+        stalled = state._roll(state.stall_rate)
+        midstream_fail = state._roll(state.midstream_fail_rate) and len(tokens) > 1
+
+        def part(content: str) -> dict:
+            body = {"model": model, "created_at": _now(), "done": False}
+            body.update({"message": {"role": "assistant", "content": content}} if chat else {"response": content})
+            return body
+
+        def final() -> dict:
+            body = part("")
+            body.update({
+                "done": True,
+                "done_reason": "length" if options.get("num_predict") == len(tokens) else "stop",
+                "total_duration": int((time.time() - start) * 1e9),
+                "load_duration": int(load_s * 1e9),
+                "prompt_eval_count": evaluated,
+                "prompt_eval_duration": int(prompt_eval_s * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(len(tokens) / state.tokens_per_sec * 1e9),
+            })
+            if not chat:
+                body["context"] = []
+            return body
+
+        if stalled:
+            self._wait(float(self.server.timeout or 600))
+            return
+
+        if not stream:
+            time.sleep(ttft + max(0, len(tokens) - 1) / state.tokens_per_sec)
+            body = final()
+            text = "".join(tokens)
+            if chat:
+                body["message"]["content"] = text
+            else:
+                body["response"] = text
+            self._send_json(200, body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._wait(ttft)
+        for i, token in enumerate(tokens):
+            if i:
+                self._wait(1.0 / state.tokens_per_sec)
+            if midstream_fail and i == len(tokens) // 2:
+                self._write_chunk({"error": "injected mid-stream failure"})
+                break
+            self._write_chunk(part(token))
+        else:
+            self._write_chunk(final())
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **config):
+    """
+    Start a stand-in server in a background thread
+
+    Args:
+        port (int): 0 picks a free port
+        **config: FakeOllama settings (ttft_s, tokens_per_sec, load_time_s, fail_rate, ...)
+
+    Returns:
+        tuple: (server, state, url); call server.shutdown() to stop it
+    """
+    handler = type("FakeOllamaHandler", (Handler,), {"state": FakeOllama(**config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler.state, f"http://{host}:{server.server_port}"
+
+
+# ===== CLI =====
+def _parse_slow(values: list) -> dict:
+    slow = {}
+    for item in values:
+        model, _, seconds = item.rpartition("=")
+        slow[model] = float(seconds)
+    return slow
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server for benchmarking the voice chatbot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    parser.add_argument("--ttft", type=float, default=DEFAULT_TTFT_S, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=DEFAULT_TOKENS_PER_SEC)
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=DEFAULT_PROMPT_TOKENS_PER_SEC)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds to load a model that is not loaded")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--midstream-fail-rate", type=float, default=0.0,
+                        help="Fraction of streams that send an error halfway through")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests that never answer")
+    parser.add_argument("--slow-models", nargs="*", default=[], metavar="MODEL=SECONDS",
+                        help="Extra time-to-first-token for specific models")
+    parser.add_argument("--missing-models", nargs="*", default=[], help="Models that answer 404")
+    parser.add_argument("--reply", help="Always answer with this text")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, _, url = start_server(
+        args.host, args.port,
+        models=args.models, ttft_s=args.ttft, tokens_per_sec=args.tokens_per_sec,
+        prompt_tokens_per_sec=args.prompt_tokens_per_sec, load_time_s=args.load_time,
+        fail_rate=args.fail_rate, midstream_fail_rate=args.midstream_fail_rate, stall_rate=args.stall_rate,
+        slow_models=_parse_slow(args.slow_models), missing_models=args.missing_models,
+        seed=args.seed, reply=args.reply
+    )
+    print(f"🤖 Stand-in Ollama on {url} (models: {', '.join(args.models)})")
+    print(f"   OLLAMA_HOST={url} python3 chatbot_vietnamese.py")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
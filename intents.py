@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local intent fast path for the voice chatbot
+A compiled Vietnamese/English phrase matcher answers simple commands (goodbye,
+time/date, repeat, volume, pause/resume, language switch) without calling Ollama
+"""
+
+import re
+import time
+import logging
+import subprocess
+import unicodedata
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Commands other than goodbye only match short utterances (whole-utterance
+# intents below are bounded by their anchors instead)
+MAX_COMMAND_WORDS = 6
+VOLUME_STEP = "10%"
+VOLUME_LIMIT = "1.0"
+
+# Checked in this order; the first intent with a matching phrase wins
+PHRASES = {
+    "switch_en": {
+        "vi": ["nói tiếng anh", "chuyển sang tiếng anh", "dùng tiếng anh"],
+        "en": ["speak english", "switch to english", "english please"],
+    },
+    "switch_vi": {
+        "vi": ["nói tiếng việt", "chuyển sang tiếng việt", "dùng tiếng việt"],
+        "en": ["speak vietnamese", "switch to vietnamese", "vietnamese please"],
+    },
+    "pause": {
+        "vi": ["tạm dừng", "im lặng", "im đi", "đừng nói nữa"],
+        "en": ["pause", "be quiet", "stop talking", "stop listening"],
+    },
+    "resume": {
+        "vi": ["tiếp tục", "dậy đi", "nghe tiếp"],
+        "en": ["resume", "continue", "wake up", "start listening"],
+    },
+    "goodbye": {
+        "vi": ["tạm biệt", "chào nhé", "dừng lại", "tắt đi", "kết thúc"],
+        "en": ["goodbye", "bye", "stop", "exit", "quit", "shut down", "turn off"],
+    },
+    "repeat": {
+        "vi": ["nói lại", "lặp lại", "nhắc lại", "vừa nói gì"],
+        "en": ["repeat", "say that again", "say it again", "come again", "what did you say"],
+    },
+    "volume_up": {
+        "vi": ["to lên", "to hơn", "lớn hơn", "nói to", "nói to lên", "tăng âm lượng", "tăng âm lượng lên"],
+        "en": ["louder", "volume up", "turn it up", "speak up", "increase the volume"],
+    },
+    "volume_down": {
+        "vi": ["nhỏ lại", "nhỏ hơn", "bé lại", "nói nhỏ", "nói nhỏ lại", "giảm âm lượng"],
+        "en": ["quieter", "softer", "volume down", "turn it down", "lower the volume"],
+    },
+    "date": {
+        "vi": ["hôm nay ngày mấy", "hôm nay là ngày mấy", "hôm nay là ngày bao nhiêu", "hôm nay thứ mấy",
+               "hôm nay là thứ mấy", "ngày bao nhiêu", "ngày mấy"],
+        "en": ["what's the date", "what is the date", "today's date", "what day is it", "what day is today"],
+    },
+    "time": {
+        "vi": ["mấy giờ", "bây giờ là mấy giờ", "bây giờ mấy giờ", "giờ là mấy giờ", "hiện tại là mấy giờ"],
+        "en": ["what time is it", "what's the time", "what is the time", "what time it is",
+               "tell me the time", "do you have the time"],
+    },
+}
+# Matched even inside long utterances (same as the old goodbye substring check)
+ANY_LENGTH = {"goodbye"}
+# Only matched while paused, so "continue the story" still goes to the LLM
+PAUSED_ONLY = {"resume"}
+# The phrase must be the whole utterance (give or take the fillers below), so
+# "what time does it open", "số nào nhỏ hơn 5", "what is the date of easter"
+# or "repeat after me: hello" still go to the LLM
+WHOLE_UTTERANCE = {"repeat", "volume_up", "volume_down", "date", "time"}
+LEADING_FILLERS = {
+    "vi": ["bạn ơi", "cho hỏi", "cho tôi hỏi", "cho mình hỏi", "bạn"],
+    "en": ["hey", "ok", "so", "excuse me", "please", "can you", "could you",
+           "can you tell me", "do you know", "tell me"],
+}
+TRAILING_FILLERS = {
+    "vi": ["rồi", "vậy", "nhỉ", "thế", "ạ", "nhé", "bạn", "đi", "nữa", "chút", "một chút"],
+    "en": ["please", "now", "right now", "a bit", "a little"],
+}
+# Utterances that must not trigger a local command (python3 intents.py checks them)
+LLM_EXAMPLES = [
+    "số nào nhỏ hơn 5", "cái nào lớn hơn", "what is the date of easter", "what day is it tomorrow",
+    "repeat after me: hello", "what time does it open", "mấy giờ thì mở cửa", "continue the story",
+]
+COMMAND_EXAMPLES = {
+    "nhỏ hơn một chút": "volume_down", "to lên nữa đi": "volume_up", "louder please": "volume_up",
+    "hôm nay là ngày mấy": "date", "what day is it": "date", "repeat": "repeat",
+    "say that again please": "repeat", "mấy giờ rồi": "time", "what time is it now": "time",
+}
+
+WEEKDAYS_VI = ["thứ Hai", "thứ Ba", "thứ Tư", "thứ Năm", "thứ Sáu", "thứ Bảy", "Chủ nhật"]
+
+REPLIES = {
+    "goodbye": {"vi": "Tạm biệt!", "en": "Goodbye!"},
+    "pause": {"vi": "Tôi sẽ im lặng. Nói 'tiếp tục' khi bạn cần tôi.",
+              "en": "I'll be quiet. Say 'resume' when you need me."},
+    "resume": {"vi": "Tôi đã sẵn sàng.", "en": "I'm listening again."},
+    "switch_en": {"en": "OK, I'll speak English."},
+    "switch_vi": {"vi": "Được, tôi sẽ nói tiếng Việt."},
+    "no_repeat": {"vi": "Tôi chưa nói gì cả.", "en": "I haven't said anything yet."},
+    "volume_up": {"vi": "Đã tăng âm lượng.", "en": "Volume up."},
+    "volume_down": {"vi": "Đã giảm âm lượng.", "en": "Volume down."},
+    "volume_failed": {"vi": "Tôi không chỉnh được âm lượng.", "en": "I couldn't change the volume."},
+}
+
+IntentResult = namedtuple("IntentResult", ["intent", "reply", "language"])
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text.lower()).replace("’", "'")
+    text = "".join(c if (c.isalnum() or c.isspace() or c == "'") else " " for c in text)
+    return " ".join(text.split())
+
+
+def _alternation(words: list) -> str:
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+def _compile(phrases: dict) -> dict:
+    """One regex per intent; named groups tell which language matched"""
+    patterns = {}
+    for intent, by_lang in phrases.items():
+        groups = []
+        for lang, words in by_lang.items():
+            if not words:
+                continue
+            alternation = _alternation(words)
+            if intent in WHOLE_UTTERANCE:
+                leading = _alternation(LEADING_FILLERS.get(lang, [])) or "(?!)"
+                trailing = _alternation(TRAILING_FILLERS.get(lang, [])) or "(?!)"
+                groups.append(f"(?P<{lang}>^(?:(?:{leading}) )*(?:{alternation})(?: (?:{trailing}))*$)")
+            else:
+                groups.append(f"(?P<{lang}>\\b(?:{alternation})\\b)")
+        if groups:
+            patterns[intent] = re.compile("|".join(groups))
+    return patterns
+
+
+class IntentEngine:
+    """
+    Rule-based intents answered locally
+
+    handle() returns an IntentResult for a matched intent (or while paused),
+    None when the utterance should go to the LLM. The caller acts on
+    "goodbye" (exit) and "switch_en"/"switch_vi" (result.language); the other
+    intents are fully handled here and only need their reply spoken.
+    """
+
+    def __init__(self, languages: tuple = ("vi", "en"), disabled: tuple = ()):
+        self.patterns = _compile({
+            intent: {lang: words for lang, words in by_lang.items() if lang in languages}
+            for intent, by_lang in PHRASES.items() if intent not in disabled
+        })
+        self.paused = False
+        self.last_reply = None
+
+    def match(self, text: str) -> Optional[tuple]:
+        """(intent, phrase_language) for the first matching intent, or None"""
+        norm = _normalize(text)
+        short = len(norm.split()) <= MAX_COMMAND_WORDS
+        for intent, pattern in self.patterns.items():
+            if not short and intent not in ANY_LENGTH and intent not in WHOLE_UTTERANCE:
+                continue  # whole-utterance phrases are already bounded by their anchors
+            if intent in PAUSED_ONLY and not self.paused:
+                continue
+            m = pattern.search(norm)
+            if m:
+                return intent, m.lastgroup
+        return None
+
+    def remember(self, reply: str):
+        """Record the last spoken reply for the repeat intent"""
+        if reply:
+            self.last_reply = reply
+
+    def handle(self, text: str, current_language: str = "vi") -> Optional[IntentResult]:
+        start = time.perf_counter()
+        found = self.match(text)
+        if found is None:
+            if not self.paused:
+                return None
+            intent, lang = "paused", current_language
+        else:
+            intent, lang = found
+            if self.paused and intent not in ("resume", "goodbye"):
+                intent = "paused"
+        # Reply in Vietnamese whenever the conversation is in Vietnamese (as generate_response does)
+        reply_lang = "vi" if current_language == "vi" or lang == "vi" else "en"
+
+        if intent == "paused":
+            result = IntentResult("paused", "", current_language)
+        elif intent in ("switch_en", "switch_vi"):
+            target = intent[-2:]
+            result = IntentResult(intent, REPLIES[intent][target], target)
+        elif intent == "time":
+            result = IntentResult(intent, self._time_reply(reply_lang), reply_lang)
+        elif intent == "date":
+            result = IntentResult(intent, self._date_reply(reply_lang), reply_lang)
+        elif intent == "repeat":
+            reply = self.last_reply or REPLIES["no_repeat"][reply_lang]
+            result = IntentResult(intent, reply, reply_lang)
+        elif intent in ("volume_up", "volume_down"):
+            ok = self._set_volume(up=intent == "volume_up")
+            result = IntentResult(intent, REPLIES[intent if ok else "volume_failed"][reply_lang], reply_lang)
+        else:
+            if intent == "pause":
+                self.paused = True
+            elif intent == "resume":
+                self.paused = False
+            result = IntentResult(intent, REPLIES[intent][reply_lang], reply_lang)
+
+        if intent not in ("repeat", "paused"):
+            self.remember(result.reply)
+        metrics.inc(f"intents.{intent}")
+        metrics.observe("intents.handle_s", time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _time_reply(lang: str) -> str:
+        now = datetime.now()
+        if lang == "vi":
+            return f"Bây giờ là {now.hour} giờ {now.minute:02d} phút."
+        return f"It's {now.strftime('%I:%M %p').lstrip('0')}."
+
+    @staticmethod
+    def _date_reply(lang: str) -> str:
+        today = datetime.now()
+        if lang == "vi":
+            return f"Hôm nay là {WEEKDAYS_VI[today.weekday()]}, ngày {today.day} tháng {today.month} năm {today.year}."
+        return f"Today is {today.strftime('%A, %B')} {today.day}, {today.year}."
+
+    @staticmethod
+    def _set_volume(up: bool) -> bool:
+        """Change the default PipeWire sink volume with wpctl"""
+        step = VOLUME_STEP + ("+" if up else "-")
+        try:
+            subprocess.run(["wpctl", "set-volume", "-l", VOLUME_LIMIT, "@DEFAULT_AUDIO_SINK@", step],
+                           check=True, capture_output=True, timeout=2)
+            return True
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Volume change failed: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    engine = IntentEngine()
+    failed = 0
+    for text in LLM_EXAMPLES:
+        found = engine.match(text)
+        if found is not None:
+            failed += 1
+            print(f"❌ {text!r} matched {found[0]}, expected the LLM")
+    for text, intent in COMMAND_EXAMPLES.items():
+        found = engine.match(text)
+        if found is None or found[0] != intent:
+            failed += 1
+            print(f"❌ {text!r} matched {found and found[0]}, expected {intent}")
+    total = len(LLM_EXAMPLES) + len(COMMAND_EXAMPLES)
+    print(f"{'✅' if not failed else '❌'} {total - failed}/{total} intent examples OK")
+    raise SystemExit(1 if failed else 0)
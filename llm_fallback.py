@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Primary/fallback LLM health tracking for the voice chatbot
+A circuit breaker remembers primary-model failures, sends turns straight to
+the fallback model during a cool-down, and probes the primary in the
+background before switching back. Hedged requests start the fallback when the
+primary misses its first-token deadline and keep whichever streams first.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterator, Optional
+
+import metrics
+import ollama_client
+import llm_stream
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+FAILURE_THRESHOLD = 2     # consecutive failures before the breaker opens
+COOLDOWN_S = 30.0         # first wait before probing the primary again
+MAX_COOLDOWN_S = 600.0    # cool-down doubles after each failed probe, up to this
+
+# Per-turn latency budget: start the next model if no token arrived after
+# LLM_HEDGE_AFTER_S (0 disables hedging), give up after LLM_FIRST_TOKEN_DEADLINE_S
+HEDGE_AFTER_S = float(os.environ.get("LLM_HEDGE_AFTER_S", "4.0"))
+FIRST_TOKEN_DEADLINE_S = float(os.environ.get("LLM_FIRST_TOKEN_DEADLINE_S", "20.0"))
+
+CLOSED = "closed"
+OPEN = "open"
+PROBING = "probing"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one model
+
+    closed: requests go to the model. open: requests skip it until the
+    cool-down ends, then a background probe runs (probing). A successful probe
+    closes the breaker, a failed one reopens it with a doubled cool-down.
+    Live turns are never used as probes.
+    """
+
+    def __init__(self, name: str, probe: Callable[[], object],
+                 failure_threshold: int = FAILURE_THRESHOLD, cooldown_s: float = COOLDOWN_S):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.base_cooldown_s = cooldown_s
+        self.cooldown_s = cooldown_s
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a request should go to this model now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown_s:
+                self.state = PROBING
+                threading.Thread(target=self._run_probe, daemon=True).start()
+        metrics.inc(f"llm.breaker.{self.name}.skipped")
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, error: Optional[Exception] = None):
+        with self._lock:
+            self.failures += 1
+            if self.state != CLOSED or self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+        metrics.inc(f"llm.breaker.{self.name}.opened")
+        logger.warning(f"🔌 {self.name} failed {self.failures} times ({error}); "
+                       f"using the fallback for {self.cooldown_s:.0f}s")
+
+    def _run_probe(self):
+        try:
+            self.probe()
+        except Exception as e:
+            with self._lock:
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.cooldown_s = min(self.cooldown_s * 2, MAX_COOLDOWN_S)
+            metrics.inc(f"llm.breaker.{self.name}.probe_failed")
+            logger.info(f"{self.name} still unhealthy ({e}); next probe in {self.cooldown_s:.0f}s")
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown_s = self.base_cooldown_s
+        metrics.inc(f"llm.breaker.{self.name}.closed")
+        logger.info(f"✅ {self.name} is healthy again, switching back from the fallback")
+
+
+def probe_model(model: str, options: Optional[dict] = None):
+    """One-token generation; raises if the model is missing or cannot be loaded"""
+    ollama_client.chat(model, messages=[{"role": "user", "content": ollama_client.WARMUP_PROMPT}],
+                       options={**(options or {}), "num_predict": 1})
+
+
+def model_breaker(model: str, options: Optional[dict] = None, **kwargs) -> CircuitBreaker:
+    """CircuitBreaker for an Ollama model, probed with probe_model()"""
+    return CircuitBreaker(model, probe=lambda: probe_model(model, options), **kwargs)
+
+
+# ===== Hedged requests =====
+_END = object()
+
+
+def _run_stream(model: str, events: queue.Queue, handle: ollama_client.StreamHandle,
+                messages: list, options: dict, kwargs: dict):
+    """Feed (model, token) events until the stream ends, fails or is cancelled"""
+    try:
+        # handle.cancel() from hedged_stream aborts the HTTP request even before the
+        # first token, so Ollama stops generating; the stream then just ends
+        for token in llm_stream.stream_chat(model, messages, options, handle=handle, **kwargs):
+            events.put((model, token))
+        events.put((model, _END))
+    except Exception as e:
+        events.put((model, e))
+
+
+def hedged_stream(models: list, messages: list, options: dict, breakers: Optional[dict] = None,
+                  hedge_after_s: float = HEDGE_AFTER_S, deadline_s: float = FIRST_TOKEN_DEADLINE_S,
+                  handle: Optional[ollama_client.StreamHandle] = None, **kwargs) -> Iterator[str]:
+    """
+    Stream a reply within a first-token deadline, hedging across models
+
+    The first model starts right away. If it has not produced a token after
+    hedge_after_s (or fails), the next model starts concurrently. The first
+    model to stream a token wins and the others are cancelled (their HTTP
+    requests are aborted at once). If no model has streamed anything by
+    deadline_s, TimeoutError is raised. A model that misses the deadline or
+    loses the hedge to a later model counts as a failure for its breaker, so
+    a primary that keeps stalling trips it.
+
+    Hedges started and the winners are counted in metrics (llm.hedge.started,
+    llm.hedge.won.<model>, llm.hedge.deadline_exceeded).
+
+    Args:
+        models (list): Models in order of preference
+        breakers (dict, optional): {model: CircuitBreaker}; open breakers are skipped
+        hedge_after_s (float): Delay before starting the next model (<= 0: only on failure)
+        deadline_s (float): First-token deadline for the whole turn
+        handle (StreamHandle, optional): Cancels the whole hedged request from another thread
+    """
+    breakers = breakers or {}
+    candidates = [m for m in models if m not in breakers or breakers[m].allow()] or models[-1:]
+    events = queue.Queue()
+    handles = {}
+    start = time.time()
+    winner = None
+    last_error = None
+    failed = set()
+
+    def launch(model):
+        handles[model] = handle.child() if handle else ollama_client.StreamHandle()
+        threading.Thread(target=_run_stream, args=(model, events, handles[model], messages, options, kwargs),
+                         daemon=True).start()
+
+    def stalled(models, error):
+        for model in models:
+            if model in breakers and model not in failed:
+                breakers[model].record_failure(error)
+
+    launch(candidates[0])
+    try:
+        while True:
+            if winner is None:
+                now = time.time() - start
+                pending = len(handles) < len(candidates)
+                if pending and hedge_after_s > 0:
+                    timeout = min(hedge_after_s * len(handles), deadline_s) - now
+                else:
+                    timeout = deadline_s - now
+                try:
+                    model, item = events.get(timeout=max(0.0, timeout))
+                except queue.Empty:
+                    if pending and time.time() - start < deadline_s:
+                        metrics.inc("llm.hedge.started")
+                        logger.info(f"⏱️  No token after {time.time() - start:.1f}s, "
+                                    f"starting {candidates[len(handles)]} in parallel")
+                        launch(candidates[len(handles)])
+                        continue
+                    metrics.inc("llm.hedge.deadline_exceeded")
+                    error = TimeoutError(f"no LLM produced a token within {deadline_s:.1f}s")
+                    stalled(handles, error)
+                    raise error
+            else:
+                model, item = events.get()
+
+            if handle is not None and handle.cancelled:
+                return  # cancelled by the caller; not a model failure
+            if winner is not None and model != winner:
+                continue  # late output from a cancelled model
+            if isinstance(item, Exception):
+                if model in breakers:
+                    breakers[model].record_failure(item)
+                if winner is not None:
+                    raise item
+                failed.add(model)
+                last_error = item
+                if len(handles) < len(candidates):
+                    logger.warning(f"⚠️ {model} failed ({item}), trying fallback model: {candidates[len(handles)]}")
+                    launch(candidates[len(handles)])
+                elif failed >= set(handles):
+                    raise last_error
+                continue
+            if winner is None:
+                winner = model
+                for other, loser in handles.items():
+                    if other != winner:
+                        loser.cancel()
+                # Models started earlier than the winner were still stalled
+                stalled(candidates[:candidates.index(winner)],
+                        TimeoutError(f"no token after {time.time() - start:.1f}s, {winner} answered first"))
+                metrics.inc(f"llm.hedge.won.{winner}")
+            if item is _END:
+                if winner in breakers:
+                    breakers[winner].record_success()
+                return
+            yield item
+    finally:
+        for child in handles.values():
+            child.cancel()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Complexity-based model routing for the voice chatbot
+A cheap feature score (length, question type, language, keywords) sends
+chit-chat to the small default model and harder questions to a larger
+model, falling back to the small model when the larger one fails
+"""
+
+import os
+import re
+import time
+import logging
+import unicodedata
+from collections import namedtuple
+from typing import Callable, Iterator, Optional
+
+import metrics
+import llm_fallback
+import ollama_client
+from response_cache import normalize_query
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Larger model for complex questions; LLM_LARGE_MODEL="" disables routing
+LARGE_MODEL = os.environ.get("LLM_LARGE_MODEL", "qwen2.5:1.5b")
+COMPLEX_THRESHOLD = float(os.environ.get("LLM_ROUTER_THRESHOLD", "2"))
+LONG_QUERY_WORDS = 14     # +1 above this, +1 more above twice this
+VI_WEIGHT = 0.5           # the small models are weaker in Vietnamese
+
+# Feature -> (weight, pattern on the lowercased query)
+FEATURES = {
+    "explain": (2, re.compile(
+        r"\b(why|how does|how do|how can|how to|explain|describe|compare|difference|pros and cons|"
+        r"what happens|what would|advantages|disadvantages|summari[sz]e|analy[sz]e|step by step)\b|"
+        r"(tại sao|vì sao|như thế nào|làm sao|làm thế nào|giải thích|so sánh|khác nhau|khác gì|"
+        r"ưu điểm|nhược điểm|phân tích|tóm tắt|từng bước)")),
+    "reasoning": (1, re.compile(
+        r"\b(calculate|compute|solve|equation|percent|plus|minus|times|divided|code|program|"
+        r"function|translate|write a|plan|recommend|should i)\b|"
+        # Whole syllables only, and the one-syllable math words only in math phrases:
+        # "nhân viên", "chia sẻ", "máy tính", "dịch vụ" are everyday words
+        r"(?<!\w)(tính toán|tính giúp|hãy tính|tính xem|giải bài|giải phương trình|phương trình|phần trăm|"
+        r"cộng với|trừ đi|nhân với|chia cho|lập trình|dịch sang|dịch giúp|dịch câu|viết một|kế hoạch|"
+        r"gợi ý|có nên)(?!\w)|\d+\s*([-+*/x×÷^]|cộng|trừ|nhân|chia)\s*\d+")),
+    "multi_part": (1, re.compile(r"\b(and also|as well as|then|after that)\b|(và cả|sau đó|đồng thời)|\?.+\?")),
+    "chit_chat": (-2, re.compile(
+        r"^(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening|night)|how are you|"
+        r"what's your name|what is your name|who are you|ok|okay|cool|nice|great)\b|"
+        r"^(xin chào|chào|cảm ơn|cám ơn|bạn khỏe không|bạn tên gì|bạn là ai|ok|được rồi|tốt)")),
+}
+
+Route = namedtuple("Route", ["name", "tiers", "score", "reasons"])
+
+
+def complexity(text: str, language: str = "en") -> tuple:
+    """(score, reasons) for a query; higher means harder"""
+    # Keeps punctuation ("?", "23*47"), unlike normalize_query
+    text = " ".join(unicodedata.normalize("NFC", text.lower()).split())
+    score, reasons = 0.0, []
+    words = len(normalize_query(text).split())
+    if words > LONG_QUERY_WORDS:
+        score += 1 + (words > 2 * LONG_QUERY_WORDS)
+        reasons.append(f"{words} words")
+    for name, (weight, pattern) in FEATURES.items():
+        if pattern.search(text):
+            score += weight
+            reasons.append(name)
+    if language == "vi":
+        score += VI_WEIGHT
+        reasons.append("vi")
+    return score, reasons
+
+
+def _model_names(list_response) -> set:
+    """Installed model names from an ollama.list response ("name" and "name:latest")"""
+    names = set()
+    for m in list_response["models"]:
+        name = m["model"]
+        names.add(name)
+        if name.endswith(":latest"):
+            names.add(name[:-len(":latest")])
+    return names
+
+
+class Router:
+    """
+    Pick the model tier for each query
+
+    route() returns a Route whose tiers are tried in order: [large], then the
+    small models for "complex"; just the small models for "simple". preload()
+    warms up the large model at startup (after check_installed()). stream()
+    runs a route and records llm.route.<name>.* (count, ttft_s, total_s,
+    fallbacks, errors).
+
+    Args:
+        small_models (list): Default models, e.g. [LLM_MODEL, FALLBACK_LLM_MODEL]
+        large_model (str, optional): Model for complex queries (None disables routing)
+        threshold (float): Minimum complexity() score for the complex route
+        options (dict, optional): Ollama options for the large model's health probe
+    """
+
+    def __init__(self, small_models: list, large_model: Optional[str] = LARGE_MODEL,
+                 threshold: float = COMPLEX_THRESHOLD, options: Optional[dict] = None):
+        self.small_models = list(small_models)
+        self.large_model = large_model or None
+        self.threshold = threshold
+        self.large_breaker = llm_fallback.model_breaker(self.large_model, options) if self.large_model else None
+
+    def check_installed(self, list_response):
+        """Disable the complex route when the large model is not pulled"""
+        if not self.large_model:
+            return
+        try:
+            installed = _model_names(list_response)
+        except (KeyError, TypeError):
+            return
+        if self.large_model not in installed:
+            logger.warning(f"{self.large_model} is not installed (ollama pull {self.large_model}); "
+                           f"complex questions will use {self.small_models[0]}")
+            self.large_model = None
+            self.large_breaker = None
+
+    def preload(self, options: Optional[dict] = None):
+        """Load and warm up the large model, so the first complex turn does not pay the cold load"""
+        if self.large_model:
+            ollama_client.preload_models(self.large_model, options=options)
+
+    def route(self, text: str, language: str = "en") -> Route:
+        score, reasons = complexity(text, language)
+        if self.large_model and score >= self.threshold:
+            route = Route("complex", [[self.large_model], self.small_models], score, reasons)
+        else:
+            route = Route("simple", [self.small_models], score, reasons)
+        metrics.inc(f"llm.route.{route.name}")
+        metrics.observe("llm.route.score", score)
+        logger.debug(f"Route {route.name} (score {score:g}: {', '.join(reasons) or 'no features'})")
+        return route
+
+    def stream(self, route: Route, stream_fn: Callable[[list], Iterator[str]]) -> Iterator[str]:
+        """
+        Yield tokens from stream_fn(models) for the first tier that produces a reply
+
+        A tier that fails before its first token (or whose breaker is open)
+        falls through to the next one and counts as a fallback; a failure
+        after tokens were streamed is raised, as in stream_chat_with_fallback.
+        """
+        prefix = f"llm.route.{route.name}"
+        start = time.time()
+        first = None
+        for i, models in enumerate(route.tiers):
+            last = i == len(route.tiers) - 1
+            breaker = self.large_breaker if models == [self.large_model] else None
+            if breaker and not breaker.allow() and not last:
+                metrics.inc(f"{prefix}.fallbacks")
+                continue
+            started = False
+            try:
+                for token in stream_fn(models):
+                    if first is None:
+                        first = time.time()
+                        metrics.observe(f"{prefix}.ttft_s", first - start)
+                    started = True
+                    yield token
+                if breaker:
+                    breaker.record_success()
+                metrics.observe(f"{prefix}.total_s", time.time() - start)
+                return
+            except Exception as e:
+                if breaker:
+                    breaker.record_failure(e)
+                if started or last:
+                    metrics.inc(f"{prefix}.errors")
+                    raise
+                metrics.inc(f"{prefix}.fallbacks")
+                logger.warning(f"⚠️ {', '.join(models)} failed ({e}), falling back to {', '.join(route.tiers[i + 1])}")
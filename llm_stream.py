@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Streaming LLM -> TTS helpers for the voice chatbot
+Streams Ollama tokens, cuts them at sentence/clause boundaries (Vietnamese and
+English punctuation) and speaks each chunk while generation continues.
+Replies are shaped to a token budget that ends on a complete sentence.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import namedtuple
+from typing import Callable, Iterable, Iterator, Optional
+
+import metrics
+import ollama_client
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+SENTENCE_END = ".!?…"
+CLAUSE_END = ",;:"
+CLOSERS = "\"')]}»”’"
+MIN_SENTENCE_CHARS = 8    # shorter sentences ("Ok.") are merged with the next one
+MIN_CLAUSE_CHARS = 40     # only cut at a comma once the chunk is this long
+RELOAD_THRESHOLD_S = 0.1  # load_duration above this means Ollama had to (re)load the model
+
+# Response shaping: stop at the first complete sentence after SOFT_TOKENS,
+# with num_predict leaving room to finish that sentence
+SOFT_TOKENS = {"simple": 40, "complex": 80}
+OVERSHOOT = 1.5
+MIN_SOFT_TOKENS = 16
+# Generation time the reply should fit in at the measured decode rate
+REPLY_BUDGET_S = float(os.environ.get("LLM_REPLY_BUDGET_S", "8"))
+DECODE_RATE_ALPHA = 0.3
+
+_DONE = object()
+_decode_rate = None  # tokens/s, EWMA over recent replies
+
+
+# ===== Token streaming =====
+def stream_chat(model: str, messages: list, options: dict, **kwargs) -> Iterator[str]:
+    """
+    Yield content tokens from a streamed chat on the pooled Ollama client
+
+    Time-to-first-token, total time and Ollama's own counters are recorded in
+    metrics (llm.ttft_s, llm.total_s, llm.prompt_eval_count, llm.eval_count).
+    Model load time is kept apart from generation time: llm.load_s (plus the
+    llm.reloads counter) when Ollama had to load the model, llm.generate_s for
+    prompt evaluation + decoding. The decode rate used by response_shape() is
+    updated from every stream, including ones closed before "done".
+    """
+    start = time.time()
+    first = None
+    count = 0
+    done = False
+    try:
+        for part in ollama_client.chat(model, messages, options, stream=True, **kwargs):
+            token = part["message"]["content"]
+            if token:
+                count += 1
+                if first is None:
+                    first = time.time()
+                    metrics.observe("llm.ttft_s", first - start)
+                yield token
+            if part.get("done"):
+                done = True
+                _record_done(model, part, start)
+    finally:
+        # Replies stopped early (shape_reply, a cancel) never see "done"; measure
+        # the decode rate from the tokens streamed since the first one instead
+        if not done and count > 1 and time.time() > first:
+            _update_decode_rate((count - 1) / (time.time() - first))
+
+
+def _record_done(model: str, part, start: float):
+    """Ollama's counters from the final part of a stream"""
+    metrics.observe("llm.total_s", time.time() - start)
+    for key in ("prompt_eval_count", "eval_count"):
+        if part.get(key) is not None:
+            metrics.observe(f"llm.{key}", part.get(key))
+    load_s = (part.get("load_duration") or 0) / 1e9
+    if load_s > RELOAD_THRESHOLD_S:
+        metrics.inc("llm.reloads")
+        metrics.observe("llm.load_s", load_s)
+        logger.info(f"{model} was not loaded: {load_s:.2f}s model load before generation")
+    metrics.observe("llm.generate_s",
+                    ((part.get("prompt_eval_duration") or 0) + (part.get("eval_duration") or 0)) / 1e9)
+    if part.get("eval_count") and part.get("eval_duration"):
+        _update_decode_rate(part["eval_count"] / (part["eval_duration"] / 1e9))
+
+
+def _update_decode_rate(rate: float):
+    global _decode_rate
+    _decode_rate = rate if _decode_rate is None else \
+        DECODE_RATE_ALPHA * rate + (1 - DECODE_RATE_ALPHA) * _decode_rate
+    metrics.observe("llm.tokens_per_s", rate)
+
+
+def stream_chat_with_fallback(models: list, messages: list, options: dict,
+                              breakers: Optional[dict] = None, **kwargs) -> Iterator[str]:
+    """
+    Stream from the first model that produces a token, trying the next one on error
+
+    A model that fails after it already streamed part of the reply is not
+    retried, so the listener never hears the start of an answer twice.
+
+    Args:
+        breakers (dict, optional): {model: llm_fallback.CircuitBreaker}; models
+            whose breaker is open are skipped (the last model is always tried)
+    """
+    breakers = breakers or {}
+    candidates = [m for m in models if m not in breakers or breakers[m].allow()] or models[-1:]
+    for i, model in enumerate(candidates):
+        breaker = breakers.get(model)
+        started = False
+        try:
+            for token in stream_chat(model, messages, options, **kwargs):
+                started = True
+                yield token
+            if breaker:
+                breaker.record_success()
+            return
+        except Exception as e:
+            if breaker:
+                breaker.record_failure(e)
+            if started or i == len(candidates) - 1:
+                raise
+            logger.warning(f"⚠️ {model} failed ({e}), trying fallback model: {candidates[i + 1]}")
+
+
+# ===== Response shaping =====
+ResponseShape = namedtuple("ResponseShape", ["soft_tokens", "num_predict"])
+
+
+def response_shape(kind: str = "simple", budget_s: float = REPLY_BUDGET_S) -> ResponseShape:
+    """
+    Token budget for a reply of the given kind (llm_router route name)
+
+    The soft limit is lowered when the recent decode rate cannot produce it
+    within budget_s; num_predict adds OVERSHOOT room to finish the sentence.
+    """
+    soft = SOFT_TOKENS.get(kind, SOFT_TOKENS["simple"])
+    if _decode_rate:
+        soft = min(soft, max(MIN_SOFT_TOKENS, int(_decode_rate * budget_s / OVERSHOOT)))
+    return ResponseShape(soft, int(soft * OVERSHOOT))
+
+
+def shape_reply(tokens: Iterator[str], shape: ResponseShape) -> Iterator[str]:
+    """
+    Release the reply clause by clause, stopping at the first sentence end after shape.soft_tokens
+
+    Text is passed on at the same sentence/clause boundaries iter_chunks()
+    cuts at, so TTS can start on the first clause; only the text after the
+    last boundary is held back. Stopping closes the token stream, so Ollama
+    stops generating. If the reply ran into num_predict mid-sentence (it
+    streamed shape.num_predict tokens), that trailing fragment is dropped
+    rather than spoken; a reply the model ended itself is passed on whole. Tokens per reply are
+    recorded as turn.tokens (one streamed part is one token), early stops
+    and trims as llm.shape.stopped/trimmed.
+    """
+    count = 0
+    held = ""
+    emitted = False
+    try:
+        for token in tokens:
+            count += 1
+            held += token
+            boundary = _find_boundary(held)
+            while boundary is not None:
+                cut, is_sentence = boundary
+                emitted = True
+                yield held[:cut]
+                held = held[cut:]
+                if is_sentence and count >= shape.soft_tokens:
+                    metrics.inc("llm.shape.stopped")
+                    return
+                boundary = _find_boundary(held)
+        if held.strip():
+            complete = held.rstrip().rstrip(CLOSERS)[-1:] in SENTENCE_END
+            if complete or not emitted or count < shape.num_predict:
+                yield held
+            else:
+                metrics.inc("llm.shape.trimmed")
+                logger.debug(f"Dropped trailing fragment: {held!r}")
+    finally:
+        metrics.observe("turn.tokens", count)
+        close = getattr(tokens, "close", None)
+        if close:
+            close()
+
+
+# ===== Sentence chunking =====
+def _find_boundary(buf: str) -> Optional[tuple]:
+    """(index just past the first speakable boundary in buf, ends a sentence), None to wait for more tokens"""
+    for i, ch in enumerate(buf):
+        if ch == "\n":
+            if buf[:i].strip():
+                return i + 1, True
+            continue
+        is_sentence = ch in SENTENCE_END
+        is_clause = ch in CLAUSE_END
+        if not (is_sentence or is_clause):
+            continue
+        if len(buf[:i].strip()) < (MIN_SENTENCE_CHARS if is_sentence else MIN_CLAUSE_CHARS):
+            continue
+        j = i + 1
+        while j < len(buf) and (buf[j] in SENTENCE_END or buf[j] in CLOSERS):
+            j += 1
+        if j >= len(buf):
+            return None  # can't tell "3." from "3.5" yet
+        if buf[j].isspace():
+            return j, is_sentence
+    return None
+
+
+def _find_cut(buf: str) -> Optional[int]:
+    """Index just past the first speakable boundary in buf, None to wait for more tokens"""
+    boundary = _find_boundary(buf)
+    return boundary[0] if boundary else None
+
+
+def iter_chunks(tokens: Iterable[str]) -> Iterator[str]:
+    """Group streamed tokens into sentence/clause chunks ready for TTS"""
+    buf = ""
+    for token in tokens:
+        buf += token
+        while True:
+            cut = _find_cut(buf)
+            if cut is None:
+                break
+            chunk, buf = buf[:cut].strip(), buf[cut:]
+            if chunk:
+                yield chunk
+    if buf.strip():
+        yield buf.strip()
+
+
+# ===== Streaming playback =====
+def speak_stream(tokens: Iterable[str], speak_fn: Callable[[str], object],
+                 turn_start: Optional[float] = None, finish_fn: Optional[Callable[[], object]] = None) -> str:
+    """
+    Speak a token stream chunk by chunk while the LLM keeps generating
+
+    Generation runs in a background thread and feeds a queue; this thread
+    speaks each chunk as soon as it is complete. Time-to-first-audio (from
+    turn_start, e.g. end of the user's speech) is printed and recorded as
+    turn.time_to_first_audio_s. Audio seconds spoken are recorded as
+    turn.audio_s: speak_fn may return the duration it played, otherwise the
+    time spent in the (blocking) call is used.
+
+    Args:
+        tokens: Token iterator (e.g. stream_chat())
+        speak_fn: Blocking TTS call taking one text chunk (optionally returning seconds played)
+        turn_start (float, optional): time.time() when the turn began
+        finish_fn (callable, optional): Called once every chunk has been handed to
+            speak_fn, for a speak_fn that only queues audio; waits for playback
+            and may return the seconds played
+
+    Returns:
+        str: Full reply text
+    """
+    turn_start = turn_start or time.time()
+    chunks = queue.Queue()
+    parts = []
+
+    def produce():
+        try:
+            def recording():
+                for token in tokens:
+                    parts.append(token)
+                    yield token
+            for chunk in iter_chunks(recording()):
+                chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    first_audio = None
+    error = None
+    audio_s = 0.0
+    while True:
+        item = chunks.get()
+        if item is _DONE:
+            break
+        if isinstance(item, Exception):
+            error = item
+            continue
+        if first_audio is None:
+            first_audio = time.time() - turn_start
+            metrics.observe("turn.time_to_first_audio_s", first_audio)
+            print(f"⏱️  Time to first audio: {first_audio:.2f}s")
+        spoken_at = time.time()
+        played = speak_fn(item)
+        audio_s += played if isinstance(played, (int, float)) else time.time() - spoken_at
+
+    producer.join()
+    if finish_fn is not None:
+        spoken_at = time.time()
+        played = finish_fn()
+        audio_s += played if isinstance(played, (int, float)) else time.time() - spoken_at
+    if audio_s:
+        metrics.observe("turn.audio_s", audio_s)
+    if error is not None and not parts:
+        raise error
+    return "".join(parts).strip()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Lightweight in-process metrics for the voice chatbot pipeline
+Counters and timing samples shared by the ASR/LLM/TTS helpers, printed at shutdown
+Set METRICS_FILE=/path/metrics.json to also write a JSON snapshot on exit
+"""
+
+import os
+import json
+import math
+import threading
+from typing import Optional
+
+METRICS_FILE = os.environ.get("METRICS_FILE")
+MAX_SAMPLES = 1000  # per timing series, oldest dropped first
+
+_lock = threading.Lock()
+_counters = {}
+_samples = {}
+_ratios = {}
+
+
+def inc(name: str, value: float = 1):
+    """Add value to a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    """Record one sample (e.g. a latency in seconds) for a series"""
+    with _lock:
+        series = _samples.setdefault(name, [])
+        series.append(value)
+        if len(series) > MAX_SAMPLES:
+            del series[0]
+
+
+def get(name: str, default: float = 0) -> float:
+    """Current value of a counter"""
+    with _lock:
+        return _counters.get(name, default)
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, math.ceil(len(ordered) * pct / 100) - 1))
+    return ordered[k]
+
+
+def snapshot() -> dict:
+    """Copy of all counters, registered ratios and count/mean/p50/p95/max for every timing series"""
+    with _lock:
+        counters = dict(_counters)
+        samples = {k: sorted(v) for k, v in _samples.items()}
+        ratio_names = dict(_ratios)
+    summaries = {}
+    for name, ordered in samples.items():
+        if not ordered:
+            continue
+        summaries[name] = {
+            "count": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": _percentile(ordered, 50),
+            "p95": _percentile(ordered, 95),
+            "max": ordered[-1],
+        }
+    ratios = {name: ratio(h, m) for name, (h, m) in ratio_names.items() if get(h) or get(m)}
+    return {"counters": counters, "ratios": ratios, "timings": summaries}
+
+
+def ratio(hits: str, misses: str) -> float:
+    """hits / (hits + misses) for two counters, 0.0 when both are empty"""
+    h, m = get(hits), get(misses)
+    return h / (h + m) if (h + m) else 0.0
+
+
+def register_ratio(name: str, hits: str, misses: str):
+    """Report hits / (hits + misses) under name in snapshot() and report()"""
+    with _lock:
+        _ratios[name] = (hits, misses)
+
+
+def report(path: Optional[str] = None):
+    """Print a summary and optionally write the JSON snapshot (defaults to METRICS_FILE)"""
+    snap = snapshot()
+    if snap["counters"] or snap["timings"]:
+        print("\n📈 Metrics:")
+        for name in sorted(snap["counters"]):
+            value = snap["counters"][name]
+            print(f"  {name:40} {value:g}")
+        for name in sorted(snap["ratios"]):
+            print(f"  {name:40} {snap['ratios'][name]:.1%}")
+        for name in sorted(snap["timings"]):
+            t = snap["timings"][name]
+            print(f"  {name:40} n={t['count']} mean={t['mean']:.3f} p50={t['p50']:.3f} p95={t['p95']:.3f}")
+
+    path = path or METRICS_FILE
+    if path:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(snap, f, indent=2)
+        except OSError as e:
+            print(f"⚠️  Could not write metrics to {path}: {e}")
+
+
+def reset():
+    """Clear all counters and samples"""
+    with _lock:
+        _counters.clear()
+        _samples.clear()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Local offline model store for the voice chatbot
+Pre-fetches Whisper and Kokoro models once, records SHA-256 checksums in a
+manifest, and loads them from fixed paths so startup never touches the network
+
+Run:
+  python3 model_store.py fetch                       # Whisper tiny.en + small, Kokoro + af_heart
+  python3 model_store.py fetch --whisper small --kokoro-voices af_heart af_bella
+  python3 model_store.py verify                      # full checksum check
+  python3 model_store.py list
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+SCRIPT_DIR = Path(__file__).resolve().parent
+MODEL_STORE_DIR = Path(os.environ.get("MODEL_STORE_DIR", str(SCRIPT_DIR / "models")))
+MANIFEST_PATH = MODEL_STORE_DIR / "manifest.json"
+
+# OFFLINE_MODELS=1: fail instead of downloading when a model is missing from the store
+STRICT_OFFLINE = os.environ.get("OFFLINE_MODELS", "0") == "1"
+
+DEFAULT_WHISPER_MODELS = ["tiny.en", "small"]
+KOKORO_REPO_ID = "hexgrad/Kokoro-82M"
+KOKORO_FILES = ["config.json", "kokoro-v1_0.pth"]
+DEFAULT_KOKORO_VOICES = ["af_heart"]
+
+HASH_CHUNK = 1024 * 1024
+
+
+class ModelStoreError(Exception):
+    """A model is missing from the store or failed its integrity check"""
+
+
+# ===== Manifest =====
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest() -> dict:
+    """Read the manifest (empty manifest if the store was never fetched)"""
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"version": 1, "models": {}}
+
+
+def _save_manifest(manifest: dict):
+    MODEL_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _record(manifest: dict, key: str, model_dir: Path):
+    """Checksum every file under model_dir and store it in the manifest"""
+    files = {}
+    for path in sorted(p for p in model_dir.rglob("*") if p.is_file() and ".cache" not in p.parts):
+        files[str(path.relative_to(model_dir))] = {
+            "sha256": _sha256(path),
+            "size": path.stat().st_size,
+        }
+    manifest["models"][key] = {
+        "path": str(model_dir.relative_to(MODEL_STORE_DIR)),
+        "files": files,
+        "fetched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def check(key: str, full: bool = False, manifest: Optional[dict] = None) -> Path:
+    """
+    Return the local directory of a stored model after an integrity check
+
+    The quick check (used at startup) compares file presence and sizes;
+    full=True also re-hashes every file against the manifest.
+
+    Args:
+        key (str): Manifest key, e.g. "whisper/small" or "kokoro"
+        full (bool): Verify SHA-256 checksums too
+        manifest (dict, optional): Already-loaded manifest
+
+    Returns:
+        Path: Model directory
+
+    Raises:
+        ModelStoreError: Model not in the store, or a file is missing/corrupt
+    """
+    manifest = manifest or load_manifest()
+    entry = manifest["models"].get(key)
+    if not entry:
+        raise ModelStoreError(f"{key} is not in the model store ({MODEL_STORE_DIR}); run: python3 model_store.py fetch")
+    model_dir = MODEL_STORE_DIR / entry["path"]
+    for rel, meta in entry["files"].items():
+        path = model_dir / rel
+        if not path.is_file() or path.stat().st_size != meta["size"]:
+            raise ModelStoreError(f"{key}: {rel} is missing or has the wrong size")
+        if full and _sha256(path) != meta["sha256"]:
+            raise ModelStoreError(f"{key}: {rel} checksum mismatch")
+    return model_dir
+
+
+# ===== Fetch =====
+def fetch_whisper(name: str, manifest: dict):
+    """Download a faster-whisper model into the store"""
+    from faster_whisper import download_model
+
+    model_dir = MODEL_STORE_DIR / "whisper" / name
+    print(f"⬇️  Whisper {name} -> {model_dir}")
+    download_model(name, output_dir=str(model_dir))
+    _record(manifest, f"whisper/{name}", model_dir)
+
+
+def fetch_kokoro(voices: list, manifest: dict):
+    """Download Kokoro weights, config and voice packs into the store"""
+    from huggingface_hub import hf_hub_download
+
+    model_dir = MODEL_STORE_DIR / "kokoro"
+    print(f"⬇️  Kokoro ({', '.join(voices)}) -> {model_dir}")
+    for filename in KOKORO_FILES + [f"voices/{v}.pt" for v in voices]:
+        hf_hub_download(repo_id=KOKORO_REPO_ID, filename=filename, local_dir=str(model_dir))
+    _record(manifest, "kokoro", model_dir)
+
+    # misaki's English G2P downloads this spaCy model on first use otherwise
+    try:
+        import spacy
+        if not spacy.util.is_package("en_core_web_sm"):
+            print("⬇️  spaCy en_core_web_sm (Kokoro English G2P)")
+            spacy.cli.download("en_core_web_sm")
+    except ImportError:
+        pass
+
+
+# ===== Offline loading =====
+def whisper_model_path(name: str) -> str:
+    """
+    Local path for a Whisper model, or the plain name when it is not stored
+
+    With OFFLINE_MODELS=1 a missing model is an error instead of a download.
+    """
+    try:
+        return str(check(f"whisper/{name}"))
+    except ModelStoreError as e:
+        if STRICT_OFFLINE:
+            raise
+        logger.warning(f"{e} - falling back to online download")
+        return name
+
+
+def load_whisper(name: str, **kwargs):
+    """
+    Create a WhisperModel, strictly offline when the model is in the store
+
+    Args:
+        name (str): Model size/name, e.g. "small"
+        **kwargs: Passed to WhisperModel (device, compute_type, cpu_threads, ...)
+    """
+    from faster_whisper import WhisperModel
+
+    path = whisper_model_path(name)
+    if path != name:
+        kwargs["local_files_only"] = True
+        kwargs.pop("download_root", None)
+    return WhisperModel(path, **kwargs)
+
+
+def load_kokoro(lang_code: str = "a", voices: Optional[list] = None):
+    """
+    Create a Kokoro KPipeline from the store with no Hugging Face calls
+
+    Voice packs are memory-mapped (torch.load(mmap=True)) and placed in the
+    pipeline's voice cache, so later tts_pipeline(text, voice=name) calls hit
+    it instead of hf_hub_download. The model weights go through KModel's own
+    torch.load, which has no mmap option. A voice missing from the store is
+    left to KPipeline to download on first use (an error with OFFLINE_MODELS=1).
+
+    Args:
+        lang_code (str): Kokoro language code
+        voices (list, optional): Voice names to preload (default DEFAULT_KOKORO_VOICES)
+    """
+    import torch
+    from kokoro import KModel, KPipeline
+
+    voices = voices or DEFAULT_KOKORO_VOICES
+    try:
+        model_dir = check("kokoro")
+    except ModelStoreError as e:
+        if STRICT_OFFLINE:
+            raise
+        logger.warning(f"{e} - falling back to online download")
+        return KPipeline(lang_code=lang_code)
+
+    kmodel = KModel(
+        repo_id=KOKORO_REPO_ID,
+        config=str(model_dir / "config.json"),
+        model=str(model_dir / "kokoro-v1_0.pth")
+    ).to("cpu").eval()
+    pipeline = KPipeline(lang_code=lang_code, repo_id=KOKORO_REPO_ID, model=kmodel)
+
+    for voice in voices:
+        voice_path = model_dir / "voices" / f"{voice}.pt"
+        if not voice_path.is_file():
+            error = ModelStoreError(f"Kokoro voice {voice} is not in the model store")
+            if STRICT_OFFLINE:
+                raise error
+            logger.warning(f"{error} - KPipeline will download it")
+            continue
+        try:
+            pack = torch.load(str(voice_path), weights_only=True, mmap=True)
+        except TypeError:
+            pack = torch.load(str(voice_path), weights_only=True)  # torch < 2.1
+        pipeline.voices[voice] = pack
+    return pipeline
+
+
+# ===== CLI =====
+def main():
+    parser = argparse.ArgumentParser(description="Offline model store for the voice chatbot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fetch = sub.add_parser("fetch", help="Download models once and write the manifest")
+    fetch.add_argument("--whisper", nargs="*", default=DEFAULT_WHISPER_MODELS)
+    fetch.add_argument("--kokoro-voices", nargs="*", default=DEFAULT_KOKORO_VOICES,
+                       help="Kokoro voices to fetch (pass none to skip Kokoro)")
+    sub.add_parser("verify", help="Re-hash every stored file against the manifest")
+    sub.add_parser("list", help="Show stored models")
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        manifest = load_manifest()
+        for name in args.whisper:
+            fetch_whisper(name, manifest)
+            _save_manifest(manifest)
+        if args.kokoro_voices:
+            fetch_kokoro(args.kokoro_voices, manifest)
+            _save_manifest(manifest)
+        print(f"✅ Model store ready: {MODEL_STORE_DIR}")
+
+    elif args.command == "verify":
+        manifest = load_manifest()
+        failed = False
+        for key in manifest["models"]:
+            try:
+                check(key, full=True, manifest=manifest)
+                print(f"✅ {key}")
+            except ModelStoreError as e:
+                print(f"❌ {e}")
+                failed = True
+        sys.exit(1 if failed else 0)
+
+    elif args.command == "list":
+        for key, entry in load_manifest()["models"].items():
+            size_mb = sum(f["size"] for f in entry["files"].values()) / (1024 * 1024)
+            print(f"{key:20} {size_mb:8.1f} MB  {entry['fetched_at']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Ollama client layer for the voice chatbot
+One pooled ollama.Client per host (keep-alive HTTP connections, explicit
+timeouts) with per-call latency metrics, load balancing across several
+Ollama hosts, plus keep_alive selection from the Pi's memory profile and
+model preload/warm-up at startup. Streaming calls can be aborted from another
+thread with a StreamHandle.
+"""
+
+import os
+import time
+import random
+import socket
+import logging
+import threading
+from typing import Iterator, Optional
+
+import httpx
+import httpcore
+import ollama
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Memory profiles (see RAM_GUIDE.md). keep_alive is how long Ollama keeps a model
+# loaded after the last request; -1 keeps it until the server stops.
+MEMORY_PROFILES = {
+    "low": {"keep_alive": "5m", "preload_fallback": False},     # 1-2GB: give RAM back to Whisper/TTS
+    "medium": {"keep_alive": "30m", "preload_fallback": False},  # 4GB
+    "high": {"keep_alive": -1, "preload_fallback": True},        # 8GB
+}
+WARMUP_PROMPT = "Hi"
+
+# OLLAMA_HOSTS="http://pi-a:11434,http://pi-b:11434"; the first host is the default
+OLLAMA_HOSTS = [h.strip() for h in os.environ.get("OLLAMA_HOSTS", os.environ.get("OLLAMA_HOST", "")).split(",")
+                if h.strip()] or ["http://127.0.0.1:11434"]
+CONNECT_TIMEOUT_S = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT_S", "3"))
+# Gap allowed between response bytes; covers a cold model load before the first token
+READ_TIMEOUT_S = float(os.environ.get("OLLAMA_READ_TIMEOUT_S", "120"))
+MAX_KEEPALIVE_CONNECTIONS = 4
+KEEPALIVE_EXPIRY_S = 120.0
+
+# Multi-host routing (only used when OLLAMA_HOSTS lists more than one host):
+# "least_outstanding" or "latency" (EWMA time-to-first-token x queue depth)
+LB_POLICY = os.environ.get("OLLAMA_LB_POLICY", "least_outstanding")
+HEALTH_CHECK_INTERVAL_S = float(os.environ.get("OLLAMA_HEALTH_CHECK_S", "15"))
+HEALTH_CHECK_TIMEOUT_S = 2.0
+LATENCY_EWMA_ALPHA = 0.3
+
+
+def _total_ram_gb() -> float:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    return 4.0
+
+
+def detect_memory_profile() -> str:
+    """MEMORY_PROFILE env var, otherwise low/medium/high from total RAM"""
+    profile = os.environ.get("MEMORY_PROFILE")
+    if profile in MEMORY_PROFILES:
+        return profile
+    ram_gb = _total_ram_gb()
+    if ram_gb < 3:
+        return "low"
+    if ram_gb < 6:
+        return "medium"
+    return "high"
+
+
+MEMORY_PROFILE = detect_memory_profile()
+
+
+def _parse_keep_alive(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+# LLM_KEEP_ALIVE overrides the profile (e.g. "10m", "-1", "0")
+KEEP_ALIVE = _parse_keep_alive(os.environ["LLM_KEEP_ALIVE"]) if os.environ.get("LLM_KEEP_ALIVE") \
+    else MEMORY_PROFILES[MEMORY_PROFILE]["keep_alive"]
+
+
+# ===== Pooled client =====
+_clients = {}
+_clients_lock = threading.Lock()
+_local = threading.local()
+
+metrics.register_ratio("ollama.connection_reuse_rate", "ollama.connections_reused", "ollama.connections_opened")
+
+
+def _trace(event: str, info: dict):
+    """httpcore trace hook: time new TCP connections"""
+    if event == "connection.connect_tcp.started":
+        _local.connect_start = time.perf_counter()
+    elif event == "connection.connect_tcp.complete":
+        _local.opened = True
+        metrics.observe("ollama.connect_s", time.perf_counter() - _local.connect_start)
+
+
+class StreamHandle:
+    """
+    Abort a streaming call from another thread
+
+    Pass it to chat(..., stream=True, handle=handle). cancel() shuts down the
+    request's socket, so it also ends a request that is still waiting for its
+    first token (model load, prompt eval); Ollama stops generating as soon as
+    the client disconnects. The cancelled stream ends quietly. One handle
+    can serve consecutive requests (e.g. a model and its fallback); child()
+    handles for concurrent requests are cancelled along with it.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._stream = None
+        self._children = []
+        self._lock = threading.Lock()
+
+    def child(self) -> "StreamHandle":
+        """Handle for a concurrent sub-request (e.g. one side of a hedged request)"""
+        child = StreamHandle()
+        with self._lock:
+            self._children.append(child)
+            cancelled = self.cancelled
+        if cancelled:
+            child.cancel()
+        return child
+
+    def _attach(self, stream):
+        with self._lock:
+            self._stream = stream
+            cancelled = self.cancelled
+        if cancelled:
+            _abort(stream)
+
+    def _detach(self):
+        """The request is over; its connection may go back to the pool for other requests"""
+        with self._lock:
+            self._stream = None
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            stream = self._stream
+            children = list(self._children)
+        if stream is not None:
+            _abort(stream)
+        for child in children:
+            child.cancel()
+
+
+def _abort(stream):
+    """Shut the socket down (unlike close(), this wakes a thread blocked reading it)"""
+    metrics.inc("ollama.streams_cancelled")
+    sock = stream.get_extra_info("socket")
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+        else:
+            stream.close()
+    except OSError:
+        pass
+
+
+class _TrackedStream(httpcore.NetworkStream):
+    """Network stream that attaches itself to the StreamHandle of the request being sent"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        handle = getattr(_local, "handle", None)
+        if handle is not None:
+            handle._attach(self._stream)
+        self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname: Optional[str] = None, timeout: Optional[float] = None):
+        return _TrackedStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+
+class _TrackedBackend(httpcore.NetworkBackend):
+    def __init__(self, backend):
+        self._backend = backend
+
+    def connect_tcp(self, *args, **kwargs):
+        return _TrackedStream(self._backend.connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs):
+        return _TrackedStream(self._backend.connect_unix_socket(*args, **kwargs))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+class _TimingTransport(httpx.HTTPTransport):
+    """HTTP transport that records whether each request opened a new connection"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # httpx has no network_backend option; wrap the pool's backend so
+        # StreamHandle can reach the socket of a request (set before any connection exists).
+        # These are httpx/httpcore internals, hence the version range in requirements.txt
+        pool = getattr(self, "_pool", None)
+        if pool is not None and hasattr(pool, "_network_backend"):
+            pool._network_backend = _TrackedBackend(pool._network_backend)
+        else:
+            logger.warning("Unsupported httpx version: StreamHandle.cancel() cannot abort requests")
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _local.opened = False
+        request.extensions["trace"] = _trace
+        response = super().handle_request(request)
+        metrics.inc("ollama.connections_opened" if _local.opened else "ollama.connections_reused")
+        return response
+
+
+def get_client(host: Optional[str] = None) -> ollama.Client:
+    """Shared ollama.Client for host (default: first of OLLAMA_HOSTS), created on first use"""
+    host = host or OLLAMA_HOSTS[0]
+    with _clients_lock:
+        client = _clients.get(host)
+        if client is None:
+            transport = _TimingTransport(limits=httpx.Limits(
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY_S
+            ))
+            client = ollama.Client(
+                host=host,
+                timeout=httpx.Timeout(READ_TIMEOUT_S, connect=CONNECT_TIMEOUT_S),
+                transport=transport
+            )
+            _clients[host] = client
+        return client
+
+
+# ===== Backend pool =====
+class _Backend:
+    def __init__(self, host: str):
+        self.host = host
+        self.outstanding = 0
+        self.latency_s = None      # EWMA of time to first chunk
+        self.healthy = True
+        self.models = None         # model names from /api/tags (None until the first check)
+
+
+class BackendPool:
+    """
+    Routes requests across several Ollama hosts
+
+    A host is eligible when it passed its last health check (/api/tags) and
+    lists the requested model. Among eligible hosts the policy picks the one
+    with the fewest outstanding requests ("least_outstanding") or the lowest
+    EWMA latency x (outstanding + 1) ("latency"). Ties go to the host that
+    served this model last (its prompt cache is warm), otherwise to a random
+    host, so separate chatbot instances spread across nodes. A request that
+    fails to connect marks its host unhealthy until the next check.
+    """
+
+    def __init__(self, hosts: list, policy: str = LB_POLICY,
+                 check_interval_s: float = HEALTH_CHECK_INTERVAL_S):
+        self.backends = {h: _Backend(h) for h in hosts}
+        self.policy = policy
+        self.check_interval_s = check_interval_s
+        self.last_host = {}     # model -> host that served it last
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.refresh()
+        if check_interval_s > 0:
+            threading.Thread(target=self._check_loop, daemon=True).start()
+
+    def refresh(self):
+        """Health-check every host and update its model list"""
+        for backend in list(self.backends.values()):
+            try:
+                with ollama.Client(host=backend.host, timeout=HEALTH_CHECK_TIMEOUT_S) as client:
+                    models = {m.model for m in client.list().models}
+            except Exception as e:
+                if backend.healthy:
+                    logger.warning(f"Ollama host {backend.host} is unhealthy: {e}")
+                with self._lock:
+                    backend.healthy = False
+                continue
+            with self._lock:
+                if not backend.healthy:
+                    logger.info(f"Ollama host {backend.host} is healthy again")
+                backend.healthy = True
+                backend.models = models
+
+    def _check_loop(self):
+        while not self._stop.wait(self.check_interval_s):
+            self.refresh()
+
+    def close(self):
+        self._stop.set()
+
+    def healthy_hosts(self, model: Optional[str] = None) -> list:
+        with self._lock:
+            return [b.host for b in self.backends.values()
+                    if b.healthy and (model is None or b.models is None or model in b.models)]
+
+    def acquire(self, model: Optional[str] = None) -> str:
+        """Pick a host for one request and count it as outstanding"""
+        with self._lock:
+            backends = list(self.backends.values())
+            eligible = [b for b in backends if b.healthy and (not model or b.models is None or model in b.models)]
+            eligible = eligible or [b for b in backends if b.healthy] or backends
+            last = self.last_host.get(model)
+            if self.policy == "latency":
+                known = [b.latency_s for b in eligible if b.latency_s is not None]
+                default = min(known) if known else 1.0
+                best = min(eligible, key=lambda b: ((b.latency_s or default) * (b.outstanding + 1),
+                                                    b.host != last, random.random()))
+            else:
+                best = min(eligible, key=lambda b: (b.outstanding, b.host != last, random.random()))
+            best.outstanding += 1
+            if model:
+                self.last_host[model] = best.host
+        metrics.inc(f"ollama.pool.requests.{best.host}")
+        return best.host
+
+    def release(self, host: str, latency_s: Optional[float] = None, error: Optional[Exception] = None):
+        """Finish a request started with acquire()"""
+        with self._lock:
+            backend = self.backends[host]
+            backend.outstanding = max(0, backend.outstanding - 1)
+            if latency_s is not None:
+                backend.latency_s = latency_s if backend.latency_s is None else \
+                    LATENCY_EWMA_ALPHA * latency_s + (1 - LATENCY_EWMA_ALPHA) * backend.latency_s
+            if isinstance(error, (ConnectionError, httpx.TransportError)):
+                backend.healthy = False
+        if isinstance(error, (ConnectionError, httpx.TransportError)):
+            metrics.inc(f"ollama.pool.errors.{host}")
+            logger.warning(f"Ollama host {host} failed ({error}); skipping it until the next health check")
+
+
+_pool = None
+
+
+def get_pool() -> Optional[BackendPool]:
+    """Shared BackendPool when OLLAMA_HOSTS lists several hosts, else None"""
+    global _pool
+    if len(OLLAMA_HOSTS) < 2:
+        return None
+    with _clients_lock:
+        if _pool is None:
+            _pool = BackendPool(OLLAMA_HOSTS)
+        return _pool
+
+
+# ===== Calls =====
+def _timed_stream(op: str, start: float, parts: Iterator, pool=None, host: Optional[str] = None,
+                  handle: Optional[StreamHandle] = None) -> Iterator:
+    first = None
+    error = None
+    try:
+        while True:
+            # The request is sent (and its socket attached to the handle) inside next()
+            _local.handle = handle
+            try:
+                part = next(parts)
+            except StopIteration:
+                break
+            finally:
+                _local.handle = None
+            if first is None:
+                first = time.perf_counter()
+                metrics.observe(f"ollama.{op}.ttft_s", first - start)
+            yield part
+        metrics.observe(f"ollama.{op}.total_s", time.perf_counter() - start)
+    except Exception as e:
+        if handle is not None and handle.cancelled:
+            return  # aborted on purpose; the host is fine
+        error = e
+        raise
+    finally:
+        if handle is not None:
+            handle._detach()
+        parts.close()
+        if pool:
+            pool.release(host, latency_s=(first - start) if first else None, error=error)
+
+
+def _call(op: str, host: Optional[str], stream: bool, handle: Optional[StreamHandle] = None, **kwargs):
+    """Run client.<op>(**kwargs), recording connect time, time to first chunk and total time"""
+    pool = get_pool() if host is None and op != "list" else None
+    if pool:
+        host = pool.acquire(kwargs.get("model"))
+    client = get_client(host)
+    start = time.perf_counter()
+    try:
+        if stream:
+            return _timed_stream(op, start, getattr(client, op)(stream=True, **kwargs), pool, host, handle)
+        result = getattr(client, op)(**kwargs)
+    except Exception as e:
+        if pool:
+            pool.release(host, error=e)
+        raise
+    elapsed = time.perf_counter() - start
+    metrics.observe(f"ollama.{op}.total_s", elapsed)
+    if pool:
+        pool.release(host, latency_s=elapsed)
+    return result
+
+
+def chat(model: str, messages: list, options: Optional[dict] = None, stream: bool = False,
+         host: Optional[str] = None, handle: Optional[StreamHandle] = None, **kwargs):
+    """ollama.chat through the pooled client (keep_alive defaults to KEEP_ALIVE; handle: see StreamHandle)"""
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    return _call("chat", host, stream, handle, model=model, messages=messages, options=options, **kwargs)
+
+
+def generate(model: str, prompt: str = "", options: Optional[dict] = None, stream: bool = False,
+             host: Optional[str] = None, **kwargs):
+    """ollama.generate through the pooled client (keep_alive defaults to KEEP_ALIVE)"""
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    return _call("generate", host, stream, model=model, prompt=prompt, options=options, **kwargs)
+
+
+def list_models(host: Optional[str] = None):
+    """
+    ollama.list through the pooled client; raises if the server is unreachable
+
+    With several OLLAMA_HOSTS and no host given, any healthy host answers.
+    """
+    pool = get_pool() if host is None else None
+    if pool:
+        pool.refresh()
+        healthy = pool.healthy_hosts()
+        if not healthy:
+            raise ConnectionError(f"No Ollama host reachable ({', '.join(OLLAMA_HOSTS)})")
+        host = healthy[0]
+    return _call("list", host, False)
+
+
+# ===== Preload / warm-up =====
+def preload(model: str, options: Optional[dict] = None, host: Optional[str] = None) -> Optional[dict]:
+    """
+    Load a model into Ollama and run a one-token warm-up generation
+
+    Load time (Ollama's load_duration) and warm-up generation time are logged
+    and recorded separately as llm.load_s and llm.warmup_s.
+
+    Args:
+        model (str): Ollama model name
+        options (dict, optional): Must match the options used for chat
+            (num_ctx in particular) or Ollama reloads the model on the first turn
+        host (str, optional): Ollama host (default: routed like any other call)
+
+    Returns:
+        dict: {"load_s", "warmup_s"} or None when the model could not be loaded
+    """
+    try:
+        start = time.time()
+        # An empty prompt only loads the model
+        resp = generate(model, prompt="", options=options, host=host)
+        load_s = (resp.get("load_duration") or 0) / 1e9 or (time.time() - start)
+
+        start = time.time()
+        chat(model, messages=[{"role": "user", "content": WARMUP_PROMPT}],
+             options={**(options or {}), "num_predict": 1}, host=host)
+        warmup_s = time.time() - start
+    except Exception as e:
+        logger.warning(f"Could not preload {model}: {e}")
+        return None
+
+    metrics.observe("llm.load_s", load_s)
+    metrics.observe("llm.warmup_s", warmup_s)
+    where = f" on {host}" if host else ""
+    print(f"  🔥 {model}{where}: loaded in {load_s:.2f}s, warm-up generation {warmup_s:.2f}s (keep_alive={KEEP_ALIVE})")
+    return {"load_s": load_s, "warmup_s": warmup_s}
+
+
+def preload_models(primary: str, fallback: Optional[str] = None, options: Optional[dict] = None):
+    """
+    Preload the primary model, and the fallback when the memory profile has room for both
+
+    With several OLLAMA_HOSTS, every healthy host that has the model is warmed up.
+    """
+    models = [primary]
+    if fallback and MEMORY_PROFILES[MEMORY_PROFILE]["preload_fallback"]:
+        models.append(fallback)
+    pool = get_pool()
+    for model in models:
+        for host in (pool.healthy_hosts(model) if pool else [None]):
+            preload(model, options, host=host)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Response cache for the voice chatbot
+LRU cache of LLM replies keyed on the normalized transcript, language, system
+prompt and model, with TTL and size eviction, persisted to disk across restarts.
+Time-sensitive questions ("mấy giờ rồi", "what's the weather") and, once there
+is earlier conversation, follow-ups that refer to it ("tell me more about
+it", "what's my name") always go to the LLM.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+CACHE_FILE = Path(os.environ.get("RESPONSE_CACHE_FILE",
+                                 str(Path.home() / ".cache" / "chatbot" / "responses.json")))
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))    # 0 disables the cache
+TTL_S = float(os.environ.get("RESPONSE_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+# Answers to these change over time, so they are never cached
+TIME_SENSITIVE = re.compile(
+    r"\b(time|date|today|tonight|tomorrow|yesterday|now|weather|news|latest|current|"
+    r"this (week|month|year)|what day)\b|"
+    r"(mấy giờ|bây giờ|hôm nay|hôm qua|ngày mai|tối nay|thứ mấy|ngày mấy|ngày bao nhiêu|"
+    r"thời tiết|tin tức|mới nhất|hiện tại|tuần này|tháng này|năm nay)"
+)
+
+# Queries whose answer may depend on earlier turns (pronouns, follow-ups, the user's own details)
+CONTEXT_DEPENDENT = re.compile(
+    r"(?<!\w)(it|its|that|this|these|those|they|them|their|he|she|him|her|his|there|"
+    r"more|again|also|another|else|same|why|previous|earlier|before|above|"
+    r"i|me|my|mine|we|us|our|you said|what about|how about|and|but|so|then)(?!\w)|"
+    r"(?<!\w)(nó|đó|đấy|này|kia|ấy|họ|thêm|nữa|tiếp|còn|tại sao|vì sao|lúc nãy|vừa rồi|"
+    r"vừa nói|ở trên|trước đó|của tôi|của mình|tên tôi|tôi tên|tôi là|tôi nói|tôi hỏi|tôi vừa)(?!\w)"
+)
+
+metrics.register_ratio("llm.cache.hit_rate", "llm.cache.hits", "llm.cache.misses")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, NFC-normalize, drop punctuation and extra spaces (keeps Vietnamese diacritics)"""
+    text = unicodedata.normalize("NFC", text.lower())
+    text = "".join(c if (c.isalnum() or c.isspace()) else " " for c in text)
+    return " ".join(text.split())
+
+
+def is_time_sensitive(text: str) -> bool:
+    return bool(TIME_SENSITIVE.search(normalize_query(text)))
+
+
+def is_context_dependent(text: str) -> bool:
+    return bool(CONTEXT_DEPENDENT.search(normalize_query(text)))
+
+
+def _bypass(query: str, has_context: bool) -> bool:
+    return is_time_sensitive(query) or (has_context and is_context_dependent(query))
+
+
+class ResponseCache:
+    """LRU + TTL reply cache persisted as JSON"""
+
+    def __init__(self, path: Optional[Path] = CACHE_FILE, max_entries: int = MAX_ENTRIES, ttl_s: float = TTL_S):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()   # key -> {"reply", "created", "query"}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(query: str, language: str, system_prompt: str, model: str) -> str:
+        raw = json.dumps([normalize_query(query), language, system_prompt, model], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not self.path or not self.max_entries:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, entry in entries.items():
+            if now - entry.get("created", 0) < self.ttl_s:
+                self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self._entries:
+            logger.info(f"💾 Loaded {len(self._entries)} cached replies from {self.path}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save response cache: {e}")
+
+    def get(self, query: str, language: str, system_prompt: str, has_context: bool = False,
+            model: str = "") -> Optional[str]:
+        """
+        Cached reply, or None on a miss, an expired entry or a time-sensitive question
+
+        has_context: the conversation memory holds earlier turns or a summary;
+        queries that may refer to them ("what's my name?", "why?") are then
+        not looked up. model: the model that would answer (part of the key).
+        """
+        if not self.max_entries:
+            return None
+        if _bypass(query, has_context):
+            metrics.inc("llm.cache.bypassed")
+            return None
+        key = self._key(query, language, system_prompt, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry["created"] >= self.ttl_s:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.inc("llm.cache.misses")
+                return None
+            self._entries.move_to_end(key)
+        metrics.inc("llm.cache.hits")
+        return entry["reply"]
+
+    def put(self, query: str, language: str, system_prompt: str, reply: str, has_context: bool = False,
+            model: str = ""):
+        """Store a reply (skipped for empty replies and for the queries get() bypasses)"""
+        if not self.max_entries or not reply or _bypass(query, has_context):
+            return
+        key = self._key(query, language, system_prompt, model)
+        with self._lock:
+            self._entries[key] = {"reply": reply, "created": time.time(), "query": normalize_query(query)}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Speculative LLM start for the voice chatbot
+When the speaker pauses mid-capture, the audio so far is transcribed and the
+reply generation starts while record_with_vad() still waits out the
+end-of-utterance silence. If the speaker did not resume, that partial
+transcript already covers the whole utterance and is used as the final
+transcript (there is no second Whisper pass competing for the CPU), so the
+running reply is kept; if they resumed, it is cancelled.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterator, Optional
+
+import metrics
+import ollama_client
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Opt-in (SPECULATIVE_LLM=1 or --speculative): costs an extra Whisper pass when the speaker resumes after a pause
+SPECULATIVE_LLM = os.environ.get("SPECULATIVE_LLM", "0") == "1"
+# Silence inside the utterance after which the transcript counts as stable
+SPECULATE_AFTER_SILENCE_MS = 300
+MIN_WORDS = 2
+
+_DONE = object()
+
+# Turns answered by the speculative reply (not_ready: no usable partial transcript in time).
+# There is no hit/miss split: the partial transcript is the final one whenever it is used.
+metrics.register_ratio("llm.speculative.ready_rate", "llm.speculative.resolved", "llm.speculative.not_ready")
+
+
+class _Speculation:
+    def __init__(self):
+        self.text = None
+        self.llm_start = None
+        self.tokens = queue.Queue()
+        self.cancelled = threading.Event()
+        self.transcribed = threading.Event()
+        self.handle = ollama_client.StreamHandle()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.handle.cancel()  # aborts the LLM request even during prompt eval
+
+
+class Speculator:
+    """
+    Runs at most one speculative reply at a time
+
+    record_with_vad() calls on_pause() once the speaker has been silent for
+    SPECULATE_AFTER_SILENCE_MS, and on_speech_resumed() if they keep talking
+    (the partial transcript was not stable, so the speculation is dropped).
+    When recording ends, transcript() waits for the partial pass and returns
+    it as the final transcript (None: transcribe as usual). resolve() then
+    returns the token stream of the reply to that transcript, or None after
+    cancelling a speculation that had no usable transcript.
+
+    Args:
+        transcribe_fn: (pcm, sample_rate, channels) -> partial transcript, or None; the
+            script's transcribe_audio(), so both passes use the same settings
+        generate_fn: (user_text, handle) -> token iterator (e.g. generate_response_stream);
+            handle is an ollama_client.StreamHandle that cancel() uses to abort the request
+    """
+
+    def __init__(self, transcribe_fn: Callable[[bytes, int, int], str],
+                 generate_fn: Callable[[str, ollama_client.StreamHandle], Iterator[str]]):
+        self.transcribe_fn = transcribe_fn
+        self.generate_fn = generate_fn
+        self._current = None
+        self._lock = threading.Lock()
+
+    def on_pause(self, audio_buffer: bytes, sample_rate: int, channels: int):
+        """Start a speculation for the audio captured so far (non-blocking)"""
+        spec = _Speculation()
+        with self._lock:
+            if self._current:
+                self._current.cancel()
+            self._current = spec
+        threading.Thread(target=self._run, args=(spec, bytes(audio_buffer), sample_rate, channels),
+                         daemon=True).start()
+
+    def on_speech_resumed(self):
+        """The speaker kept talking: the partial transcript is stale"""
+        if self.cancel():
+            metrics.inc("llm.speculative.cancelled")
+
+    def cancel(self) -> bool:
+        """Drop the current speculation, if any"""
+        with self._lock:
+            spec, self._current = self._current, None
+        if spec:
+            spec.cancel()
+        return spec is not None
+
+    def transcript(self) -> Optional[str]:
+        """
+        Final transcript from the partial pass, if the speaker did not resume after the pause
+
+        Blocks until the partial pass is done instead of starting a second
+        Whisper pass next to it. None when there is no speculation (or its
+        transcription failed); the caller then transcribes the recording.
+        """
+        with self._lock:
+            spec = self._current
+        if spec is None:
+            return None
+        spec.transcribed.wait()
+        if spec.cancelled.is_set() or not spec.text:
+            return None
+        metrics.inc("llm.speculative.transcript_reused")
+        return spec.text
+
+    def _run(self, spec: _Speculation, audio_buffer: bytes, sample_rate: int, channels: int):
+        try:
+            try:
+                spec.text = self.transcribe_fn(audio_buffer, sample_rate, channels) or ""
+                if not spec.cancelled.is_set() and len(spec.text.split()) >= MIN_WORDS:
+                    spec.llm_start = time.time()
+            finally:
+                spec.transcribed.set()  # transcript() and resolve() see text and llm_start together
+            if spec.llm_start is None:
+                return
+            metrics.inc("llm.speculative.started")
+            stream = self.generate_fn(spec.text, spec.handle)
+            try:
+                for token in stream:
+                    if spec.cancelled.is_set():
+                        break
+                    spec.tokens.put(token)
+            finally:
+                stream.close()  # closes the HTTP stream so Ollama stops generating
+        except Exception as e:
+            logger.debug(f"Speculation failed: {e}")
+            spec.tokens.put(e)
+        finally:
+            spec.tokens.put(_DONE)
+
+    def resolve(self) -> Optional[Iterator[str]]:
+        """
+        Token stream of the speculative reply (made for the transcript() returned)
+
+        Returns None (and cancels the speculation) when the partial transcript
+        was not ready or too short; the caller then generates as usual.
+        """
+        with self._lock:
+            spec, self._current = self._current, None
+        if spec is None:
+            return None
+        if spec.llm_start is None:
+            spec.cancel()  # partial transcript not ready (or too short) yet
+            metrics.inc("llm.speculative.not_ready")
+            return None
+        saved = time.time() - spec.llm_start
+        metrics.inc("llm.speculative.resolved")
+        metrics.observe("llm.speculative.saved_s", saved)
+        print(f"⚡ Speculative reply: started {saved:.2f}s early")
+        return self._drain(spec)
+
+    @staticmethod
+    def _drain(spec: _Speculation) -> Iterator[str]:
+        while True:
+            item = spec.tokens.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+On-disk TTS audio cache for the voice chatbot
+Content-addressed by (engine, voice, speed, normalized text), so fixed phrases
+("Tạm biệt!", the apology) and frequent replies play without synthesis or a
+network round trip. Files are evicted least-recently-used past a size cap.
+"""
+
+import io
+import os
+import json
+import wave
+import hashlib
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+CACHE_DIR = Path(os.environ.get("TTS_CACHE_DIR", str(Path.home() / ".cache" / "chatbot" / "tts")))
+MAX_MB = float(os.environ.get("TTS_CACHE_MB", "100"))    # 0 disables the cache
+MAX_TEXT_CHARS = 400      # longer texts are unlikely to repeat
+READ_CHUNK_S = 0.5        # cached PCM is replayed in chunks of this length
+
+metrics.register_ratio("tts.cache.hit_rate", "tts.cache.hits", "tts.cache.misses")
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalize and collapse whitespace (case and punctuation change prosody, so they are kept)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(engine: str, voice, speed, text: str) -> str:
+    raw = json.dumps([engine, str(voice), str(speed), normalize_text(text)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def wav_bytes(pcm: bytes, rate: int, channels: int = 1) -> bytes:
+    """Wrap s16 PCM in a WAV header"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+class TTSCache:
+    """
+    LRU cache of synthesized audio files
+
+    get() returns the path of a cached file (and marks it recently used),
+    put() stores bytes under the key and evicts the least recently used
+    files once the directory is over max_bytes. Recency is the file mtime,
+    so it survives restarts.
+
+    Args:
+        directory (Path): Cache directory
+        max_bytes (int): Size cap (0 disables the cache)
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = int(MAX_MB * 1024 * 1024)):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()   # key -> (path, size), least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _scan(self):
+        if not self.enabled or not self.directory.is_dir():
+            return
+        entries = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp" or not path.is_file():
+                continue
+            st = path.stat()
+            entries.append((st.st_mtime, path.stem, path, st.st_size))
+        for _, key, path, size in sorted(entries):
+            self._files[key] = (path, size)
+            self._total += size
+        if self._files:
+            logger.info(f"💾 TTS cache: {len(self._files)} files, {self._total / 1e6:.1f} MB in {self.directory}")
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._files:
+            _, (path, size) = self._files.popitem(last=False)
+            self._total -= size
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            metrics.inc("tts.cache.evictions")
+
+    def get(self, engine: str, voice, speed, text: str) -> Optional[Path]:
+        """Path of the cached audio, or None on a miss"""
+        if not self.enabled or len(text) > MAX_TEXT_CHARS:
+            return None
+        key = cache_key(engine, voice, speed, text)
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is None or not entry[0].exists():
+                if entry is not None:
+                    del self._files[key]
+                    self._total -= entry[1]
+                metrics.inc("tts.cache.misses")
+                return None
+            self._files.move_to_end(key)
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        metrics.inc("tts.cache.hits")
+        return entry[0]
+
+    def put(self, engine: str, voice, speed, text: str, data: bytes, ext: str) -> Optional[Path]:
+        """Store audio bytes (e.g. ext "wav" or "mp3"); returns the cached path, None if not cached"""
+        if not self.enabled or not data or len(text) > MAX_TEXT_CHARS:
+            return None
+        key = cache_key(engine, voice, speed, text)
+        path = self.directory / f"{key}.{ext}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache entry: {e}")
+            return None
+        with self._lock:
+            old = self._files.pop(key, None)
+            if old:
+                self._total -= old[1]
+            self._files[key] = (path, len(data))
+            self._total += len(data)
+            self._evict()
+        return path
+
+    def discard(self, engine: str, voice, speed, text: str):
+        """Remove the cached audio for text (e.g. a file that turned out to be unreadable)"""
+        key = cache_key(engine, voice, speed, text)
+        with self._lock:
+            entry = self._files.pop(key, None)
+            if entry is None:
+                return
+            self._total -= entry[1]
+        try:
+            entry[0].unlink()
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for path, _ in self._files.values():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._files.clear()
+            self._total = 0
+
+
+def get_cache() -> TTSCache:
+    """Shared cache instance (TTS_CACHE_DIR / TTS_CACHE_MB)"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = TTSCache()
+        return _default_cache
+
+
+def cached_pcm(engine: str, voice, speed, text: str, synthesize: Callable[[str], Iterator[bytes]],
+               rate: int, channels: int = 1, cache: Optional[TTSCache] = None) -> Iterator[bytes]:
+    """
+    s16 PCM chunks for text, from the cache or from synthesize(text)
+
+    On a miss the chunks are passed through as they are synthesized and the
+    whole utterance is stored once synthesis completes (not if the consumer
+    stops early, e.g. on a cancel). An unreadable cache file is removed
+    (tts.cache.corrupt) and the text synthesized again, unless part of it
+    was already played.
+    """
+    cache = cache or get_cache()
+    path = cache.get(engine, voice, speed, text)
+    if path is not None:
+        played = False
+        try:
+            with wave.open(str(path), "rb") as wf:
+                frames = max(1, int(wf.getframerate() * READ_CHUNK_S))
+                while True:
+                    pcm = wf.readframes(frames)
+                    if not pcm:
+                        return
+                    played = True
+                    yield pcm
+        except (OSError, wave.Error, EOFError) as e:
+            logger.warning(f"Unreadable TTS cache entry {path.name}, removing it: {e}")
+            metrics.inc("tts.cache.corrupt")
+            cache.discard(engine, voice, speed, text)
+            if played:
+                return
+    chunks = []
+    for pcm in synthesize(text):
+        chunks.append(pcm)
+        yield pcm
+    cache.put(engine, voice, speed, text, wav_bytes(b"".join(chunks), rate, channels), "wav")
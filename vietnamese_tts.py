@@ -5,96 +5,239 @@ Supports multiple TTS engines with fallback options
 Optimized for Pi 4 8GB RAM with Vietnamese pronunciation
 """
 
+import io
 import os
+import json
+import shutil
 import tempfile
 import subprocess
 import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import pygame
 from pathlib import Path
 from typing import Optional, Union
 import logging
 
+import metrics
+import tts_cache
+import audio_playback
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ===== Configuration =====
+# Engine probe results, reused while the engine binaries are unchanged
+ENGINE_CACHE_PATH = Path(os.environ.get("TTS_ENGINE_CACHE",
+                                        str(Path.home() / ".cache" / "chatbot" / "tts_engines.json")))
+PROBE_TIMEOUT_S = 5
+# Engine -> binary probed with `--version` / Python module (imported on first use)
+ENGINE_BINARIES = {"espeak": "espeak-ng", "festival": "festival"}
+ENGINE_MODULES = {"gtts": "gtts", "edge": "edge_tts"}
+ENGINE_ORDER = ["gtts", "espeak", "festival", "edge"]   # fallback order
+ENGINE_LABELS = {"gtts": "gTTS", "espeak": "espeak-ng", "festival": "Festival", "edge": "Edge-TTS"}
+
+
+def _probe_binary(binary: str) -> bool:
+    try:
+        result = subprocess.run([binary, "--version"],
+                                capture_output=True, text=True, timeout=PROBE_TIMEOUT_S)
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, OSError):
+        return False
+
+
+def _binary_signature(binary: str) -> Optional[list]:
+    """[resolved path, mtime] of an installed binary, None if it is not on PATH"""
+    path = shutil.which(binary)
+    if not path:
+        return None
+    try:
+        return [os.path.realpath(path), os.stat(path).st_mtime]
+    except OSError:
+        return None
+
+
+def _load_engine_cache() -> dict:
+    try:
+        with open(ENGINE_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_engine_cache(entries: dict):
+    try:
+        ENGINE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ENGINE_CACHE_PATH.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp, ENGINE_CACHE_PATH)
+    except OSError as e:
+        logger.debug(f"Could not save TTS engine cache: {e}")
+
+
+def discover_engines() -> dict:
+    """
+    {engine: available} for every known engine
+
+    Binaries are probed concurrently, and only when their path or mtime
+    changed since the cached probe (an upgrade or removal re-probes).
+    Python engines are found with find_spec, without importing them.
+    """
+    cached = _load_engine_cache()
+    entries, to_probe = {}, {}
+    for engine, binary in ENGINE_BINARIES.items():
+        signature = _binary_signature(binary)
+        entry = cached.get(binary)
+        if signature is None:
+            entries[binary] = {"signature": None, "ok": False}
+        elif entry and entry.get("signature") == signature:
+            entries[binary] = entry
+        else:
+            to_probe[binary] = signature
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+            results = dict(zip(to_probe, pool.map(_probe_binary, to_probe)))
+        for binary, signature in to_probe.items():
+            entries[binary] = {"signature": signature, "ok": results[binary]}
+    if entries != cached:
+        _save_engine_cache(entries)
+
+    found = {engine: entries[binary]["ok"] for engine, binary in ENGINE_BINARIES.items()}
+    for engine, module in ENGINE_MODULES.items():
+        try:
+            found[engine] = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            found[engine] = False
+    return found
+
+
 class VietnameseTTS:
     """Vietnamese Text-to-Speech with multiple engine support"""
     
-    def __init__(self, preferred_engine="gtts"):
+    def __init__(self, preferred_engine="gtts", cache: Optional[tts_cache.TTSCache] = None):
         """
         Initialize TTS with preferred engine
         
         Args:
             preferred_engine (str): "gtts", "zalo", "edge", "espeak", "festival"
+            cache (TTSCache, optional): Audio cache for the online engines (default: shared cache)
         """
         self.preferred_engine = preferred_engine
         self.available_engines = []
+        self.cache = cache or tts_cache.get_cache()
         pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=1024)
+        # Without ffmpeg, MP3 replies are decoded by pygame after the download completes
+        self.mp3_streaming = audio_playback.have_mp3_decoder()
         self._check_available_engines()
     
     def _check_available_engines(self):
-        """Check which TTS engines are available"""
-        # Check gTTS (requires internet)
-        try:
-            from gtts import gTTS
-            self.available_engines.append("gtts")
-            logger.info("✅ gTTS available")
-        except ImportError:
-            logger.warning("⚠️ gTTS not available")
-        
-        # Check espeak-ng
-        try:
-            result = subprocess.run(["espeak-ng", "--version"], 
-                                  capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                self.available_engines.append("espeak")
-                logger.info("✅ espeak-ng available")
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            logger.warning("⚠️ espeak-ng not available")
+        """Check which TTS engines are available (gTTS and Edge-TTS need internet)"""
+        found = discover_engines()
+        for engine in ENGINE_ORDER:
+            if found.get(engine):
+                self.available_engines.append(engine)
+                logger.info(f"✅ {ENGINE_LABELS[engine]} available")
+            else:
+                logger.warning(f"⚠️ {ENGINE_LABELS[engine]} not available")
         
-        # Check festival
+        logger.info(f"Available TTS engines: {self.available_engines}")
+    
+    def _play_file(self, path):
+        """Play an audio file with pygame and wait for it to finish"""
+        pygame.mixer.music.load(str(path))
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy():
+            time.sleep(0.1)
+    
+    def _play_cached(self, engine: str, voice, speed, text: str) -> bool:
+        """Play the cached audio for text, if any"""
+        path = self.cache.get(engine, voice, speed, text)
+        if path is None:
+            return False
+        self._play_file(path)
+        return True
+    
+    def _play_pcm_stream(self, pcm_chunks):
+        """
+        Play s16 PCM chunks in the mixer's format as they arrive, queued on one mixer channel
+
+        If pcm_chunks raises, the audio already queued is played out before the error propagates.
+        """
+        channel = None
         try:
-            result = subprocess.run(["festival", "--version"], 
-                                  capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                self.available_engines.append("festival")
-                logger.info("✅ Festival available")
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            logger.warning("⚠️ Festival not available")
+            for pcm in pcm_chunks:
+                sound = pygame.mixer.Sound(buffer=pcm)
+                if channel is None:
+                    channel = pygame.mixer.find_channel(True)
+                    channel.play(sound)
+                    continue
+                # A channel holds one queued sound; it plays at once if the channel ran dry
+                while channel.get_queue() is not None:
+                    time.sleep(0.02)
+                channel.queue(sound)
+        finally:
+            while channel is not None and channel.get_busy():
+                time.sleep(0.05)
+    
+    def _play_mp3_stream(self, engine: str, voice, speed, text: str, mp3_chunks):
+        """
+        Decode MP3 chunks in memory and play them as they arrive; cache the MP3 once complete
+
+        If the download or the decoder fails after some audio has played, the
+        reply counts as spoken: the error is logged (tts.partial_playback) and
+        nothing is cached, rather than letting speak() replay the whole text on
+        another engine. Failures before any audio raise as usual.
+        """
+        received = []
         
-        # Check edge-tts
-        try:
-            import edge_tts
-            self.available_engines.append("edge")
-            logger.info("✅ Edge-TTS available")
-        except ImportError:
-            logger.warning("⚠️ Edge-TTS not available")
+        def _collect():
+            for chunk in mp3_chunks:
+                received.append(chunk)
+                yield chunk
         
-        logger.info(f"Available TTS engines: {self.available_engines}")
+        if self.mp3_streaming:
+            freq, _, channels = pygame.mixer.get_init()
+            pcm_chunks = audio_playback.decode_mp3_stream(_collect(), freq, channels)
+            played = [0]
+            
+            def _count():
+                for pcm in pcm_chunks:
+                    played[0] += 1
+                    yield pcm
+            
+            try:
+                self._play_pcm_stream(_count())
+            except Exception as e:
+                if not played[0]:
+                    raise
+                metrics.inc("tts.partial_playback")
+                logger.error(f"{engine} stream failed after playback started, not retrying: {e}")
+                return
+        else:
+            data = b"".join(_collect())
+            pygame.mixer.music.load(io.BytesIO(data), "mp3")
+            pygame.mixer.music.play()
+            while pygame.mixer.music.get_busy():
+                time.sleep(0.1)
+        self.cache.put(engine, voice, speed, text, b"".join(received), "mp3")
     
     def _speak_gtts(self, text: str, lang: str = "vi", slow: bool = False) -> bool:
         """Use Google TTS (requires internet)"""
         try:
+            if self._play_cached("gtts", lang, slow, text):
+                return True
+            
             from gtts import gTTS
             
+            # gTTS requests the text in parts; each part's MP3 plays as soon as it is decoded
             tts = gTTS(text=text, lang=lang, slow=slow)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-                
-                # Play using pygame
-                pygame.mixer.music.load(tmp_file.name)
-                pygame.mixer.music.play()
-                
-                # Wait for playback to finish
-                while pygame.mixer.music.get_busy():
-                    time.sleep(0.1)
-                
-                # Clean up
-                os.unlink(tmp_file.name)
-                return True
+            self._play_mp3_stream("gtts", lang, slow, text, tts.stream())
+            return True
                 
         except Exception as e:
             logger.error(f"gTTS error: {e}")
@@ -103,30 +246,29 @@ class VietnameseTTS:
     def _speak_edge_tts(self, text: str, voice: str = "vi-VN-HoaiMyNeural") -> bool:
         """Use Microsoft Edge TTS (requires internet)"""
         try:
+            if self._play_cached("edge", voice, None, text):
+                return True
+            
             import asyncio
             import edge_tts
             
-            async def _edge_speak():
-                tts = edge_tts.Communicate(text, voice)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                    async for chunk in tts.stream():
+            def _edge_chunks():
+                # Drive the async stream from the decoder's feeder thread
+                loop = asyncio.new_event_loop()
+                stream = edge_tts.Communicate(text, voice).stream()
+                try:
+                    while True:
+                        try:
+                            chunk = loop.run_until_complete(stream.__anext__())
+                        except StopAsyncIteration:
+                            return
                         if chunk["type"] == "audio":
-                            tmp_file.write(chunk["data"])
-                    
-                    # Play the file
-                    pygame.mixer.music.load(tmp_file.name)
-                    pygame.mixer.music.play()
-                    
-                    while pygame.mixer.music.get_busy():
-                        await asyncio.sleep(0.1)
-                    
-                    os.unlink(tmp_file.name)
+                            yield chunk["data"]
+                finally:
+                    loop.run_until_complete(stream.aclose())
+                    loop.close()
             
-            # Run async function
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(_edge_speak())
-            loop.close()
+            self._play_mp3_stream("edge", voice, None, text, _edge_chunks())
             return True
             
         except Exception as e:
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Whisper (faster-whisper) transcription helpers shared by the chatbot scripts
+Keeps the decode settings used by every transcribe_audio() in one place
+Optimized for Raspberry Pi 4 CPU-only inference
+"""
+
+import os
+import time
+import wave
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+import numpy as np
+
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ===== Configuration =====
+# Whisper's internal Silero VAD settings (used when segmentation is not trusted)
+VAD_MIN_SILENCE_MS = 500
+SPEECH_PAD_MS = 200
+
+# Trusted segmentation: record_with_vad() already endpointed the utterance,
+# so skip Whisper's second VAD pass and only keep a short pad after speech.
+TRUSTED_SEGMENTATION = os.environ.get("TRUSTED_SEGMENTATION", "0") == "1"
+
+BYTES_PER_SAMPLE = 2  # s16
+
+# Decode budget: cap generated tokens by audio length so noise-only captures
+# cannot turn into long hallucinated loops. English runs ~3 words/s (~4-5
+# tokens/s); Vietnamese syllables are mostly split into 2-4 byte-level tokens,
+# so fast Vietnamese speech needs about twice that. Auto-detect uses the
+# Vietnamese rate. Segments cut at the budget are counted as asr.truncated_segments.
+TOKENS_PER_SECOND = {"en": 8, "vi": 16}
+DEFAULT_TOKENS_PER_SECOND = 16
+MIN_NEW_TOKENS = 16
+MAX_NEW_TOKENS = 224
+
+# Segment rejection (same signals Whisper itself uses for its fallback)
+NO_SPEECH_PROB_THRESHOLD = 0.6
+LOW_AVG_LOGPROB_THRESHOLD = -1.0   # rejected together with a high no_speech_prob
+MIN_AVG_LOGPROB = -1.5             # rejected on its own
+COMPRESSION_RATIO_THRESHOLD = 2.4  # gzip ratio above this means repeated text
+
+
+def transcribe_kwargs(language: Optional[str] = None, trusted_segmentation: Optional[bool] = None,
+                      duration_s: Optional[float] = None) -> dict:
+    """
+    Build the keyword arguments passed to WhisperModel.transcribe()
+
+    Args:
+        language (str, optional): Whisper language code, None to auto-detect
+        trusted_segmentation (bool, optional): Skip Whisper's VAD, defaults to TRUSTED_SEGMENTATION
+        duration_s (float, optional): Audio length, used to cap generated tokens
+
+    Returns:
+        dict: Keyword arguments for transcribe()
+    """
+    if trusted_segmentation is None:
+        trusted_segmentation = TRUSTED_SEGMENTATION
+
+    kwargs = dict(
+        language=language,
+        beam_size=1,
+        best_of=1,
+        temperature=0.0,
+        compression_ratio_threshold=COMPRESSION_RATIO_THRESHOLD,
+        log_prob_threshold=LOW_AVG_LOGPROB_THRESHOLD,
+        no_speech_threshold=NO_SPEECH_PROB_THRESHOLD,
+        condition_on_previous_text=False,  # a hallucinated window must not seed the next one
+    )
+    if duration_s is not None:
+        kwargs["max_new_tokens"] = decode_budget(duration_s, language)
+    if trusted_segmentation:
+        kwargs["vad_filter"] = False
+    else:
+        kwargs["vad_filter"] = True
+        kwargs["vad_parameters"] = dict(
+            min_silence_duration_ms=VAD_MIN_SILENCE_MS,
+            speech_pad_ms=SPEECH_PAD_MS
+        )
+    return kwargs
+
+
+def decode_budget(duration_s: float, language: Optional[str] = None) -> int:
+    """Max tokens Whisper may generate for audio of this length in this language"""
+    rate = TOKENS_PER_SECOND.get(language, DEFAULT_TOKENS_PER_SECOND)
+    return int(max(MIN_NEW_TOKENS, min(MAX_NEW_TOKENS, duration_s * rate)))
+
+
+def count_truncated(token_counts: dict, budget: Optional[int]) -> int:
+    """
+    Count decode windows that used up the token budget (their text was cut off)
+
+    Args:
+        token_counts (dict): Tokens generated per 30 s window (segment.seek) or per clip
+        budget (int, optional): max_new_tokens the audio was decoded with
+
+    Returns:
+        int: Truncated windows, also added to asr.truncated_segments
+    """
+    if not budget:
+        return 0
+    truncated = sum(1 for n in token_counts.values() if n >= budget)
+    if truncated:
+        metrics.inc("asr.truncated_segments", truncated)
+        logger.debug(f"{truncated} segment(s) stopped at the {budget}-token decode budget")
+    return truncated
+
+
+def wav_duration(audio_path) -> float:
+    """Length of a WAV file in seconds (0.0 if it cannot be read)"""
+    try:
+        with wave.open(str(audio_path), "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate())
+    except (OSError, wave.Error, ZeroDivisionError):
+        return 0.0
+
+
+def audio_duration(audio) -> float:
+    """Length of a WAV path or a 16 kHz float32 array in seconds"""
+    if isinstance(audio, np.ndarray):
+        return len(audio) / WHISPER_SAMPLE_RATE
+    return wav_duration(audio)
+
+
+def reject_reason(segment) -> Optional[str]:
+    """Why a decoded segment looks like a hallucination, or None if it is kept"""
+    no_speech = getattr(segment, "no_speech_prob", 0.0)
+    avg_logprob = getattr(segment, "avg_logprob", 0.0)
+    if no_speech > NO_SPEECH_PROB_THRESHOLD and avg_logprob < LOW_AVG_LOGPROB_THRESHOLD:
+        return "no_speech"
+    if avg_logprob < MIN_AVG_LOGPROB:
+        return "low_logprob"
+    if getattr(segment, "compression_ratio", 0.0) > COMPRESSION_RATIO_THRESHOLD:
+        return "repetition"
+    return None
+
+
+def _is_repeating(texts: list, text: str) -> bool:
+    """True when a segment repeats the previous one or is a loop of one short phrase"""
+    norm = text.strip().lower()
+    if not norm:
+        return False
+    if texts and texts[-1].strip().lower() == norm:
+        return True
+    words = norm.split()
+    if len(words) >= 8:
+        for n in (1, 2, 3):
+            grams = [" ".join(words[i:i + n]) for i in range(0, len(words) - n + 1, n)]
+            if grams and max(grams.count(g) for g in set(grams)) / len(grams) > 0.6:
+                return True
+    return False
+
+
+def collect_text(segments, duration_s: float = 0.0, language: Optional[str] = None) -> str:
+    """
+    Join decoded segments, dropping hallucinations and stopping on repetition
+
+    segments is faster-whisper's lazy generator, so breaking out of the loop
+    also stops any further decoding. Rejections are counted in metrics
+    (asr.rejected_segments.*, asr.aborted_repetition, asr.rejected_utterances,
+    asr.rejected_audio_s) together with the decode time spent on them, and
+    windows cut off by the decode budget as asr.truncated_segments.
+
+    Args:
+        segments: Segments from WhisperModel.transcribe()
+        duration_s (float): Audio length, for the rejected-audio counter and the decode budget
+        language (str, optional): Language passed to transcribe_kwargs(), for the decode budget
+
+    Returns:
+        str: Transcript (empty when everything was rejected)
+    """
+    start = time.time()
+    texts = []
+    rejected = 0
+    window_tokens = {}
+    for seg in segments:
+        seek = getattr(seg, "seek", 0)
+        window_tokens[seek] = window_tokens.get(seek, 0) + len(getattr(seg, "tokens", None) or [])
+        reason = reject_reason(seg)
+        if reason is None and _is_repeating(texts, seg.text):
+            reason = "repetition"
+        if reason:
+            rejected += 1
+            metrics.inc(f"asr.rejected_segments.{reason}")
+            if reason == "repetition":
+                metrics.inc("asr.aborted_repetition")
+                break
+            continue
+        texts.append(seg.text.strip())
+
+    if duration_s:
+        count_truncated(window_tokens, decode_budget(duration_s, language))
+    text = " ".join(texts).strip()
+    if rejected and not text:
+        # Whole capture was junk: this also skips an LLM + TTS round trip
+        metrics.inc("asr.rejected_utterances")
+        metrics.inc("asr.rejected_audio_s", duration_s)
+        metrics.inc("asr.rejected_decode_s", time.time() - start)
+    return text
+
+
+def trim_to_speech(audio_buffer: bytes, speech_end_bytes: int, sample_rate: int,
+                   channels: int, pad_ms: int = SPEECH_PAD_MS) -> bytes:
+    """
+    Cut the trailing silence that record_with_vad() keeps after the last voiced frame
+
+    The capture stage starts buffering at speech onset, so the only boundary
+    left to apply is the end of speech (plus a short pad, like Silero's speech_pad_ms).
+
+    Args:
+        audio_buffer (bytes): Raw s16 PCM from the capture stage
+        speech_end_bytes (int): Buffer length right after the last voiced frame
+        sample_rate (int): Capture sample rate
+        channels (int): Capture channel count
+        pad_ms (int): Audio to keep after the last voiced frame
+
+    Returns:
+        bytes: PCM trimmed to the speech boundaries
+    """
+    if not audio_buffer or speech_end_bytes <= 0:
+        return audio_buffer
+    frame_align = BYTES_PER_SAMPLE * channels
+    pad_bytes = int(sample_rate * pad_ms / 1000) * frame_align
+    end = min(len(audio_buffer), speech_end_bytes + pad_bytes)
+    end -= end % frame_align
+    return audio_buffer[:end]
+
+
+def pcm_to_float(audio_buffer: bytes, sample_rate: int, channels: int) -> np.ndarray:
+    """Raw s16 PCM from the capture stage to 16 kHz mono float32 for transcribe()"""
+    samples = np.frombuffer(audio_buffer, dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    if sample_rate != 16000 and len(samples):
+        n_out = int(len(samples) * 16000 / sample_rate)
+        samples = np.interp(np.linspace(0, len(samples) - 1, n_out), np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+
+# ===== Batched transcription =====
+WHISPER_SAMPLE_RATE = 16000
+MAX_BATCH_SIZE = 8
+BATCH_WAIT_MS = 50  # how long the worker waits for more utterances to join a batch
+CLIP_GAP_S = 0.5    # silence inserted between utterances in a batch
+
+
+def _load_audio(audio):
+    """Decode a WAV path / file-like object to 16 kHz mono float32 (arrays pass through)"""
+    if isinstance(audio, np.ndarray):
+        return audio.astype(np.float32, copy=False)
+    from faster_whisper import decode_audio
+    return decode_audio(audio, sampling_rate=WHISPER_SAMPLE_RATE)
+
+
+def transcribe_batch(whisper_model, audios: list, language: Optional[str] = None,
+                     batch_size: int = MAX_BATCH_SIZE, batched_pipeline=None) -> list:
+    """
+    Transcribe several utterances with a single batched faster-whisper call
+
+    Utterances are laid end to end (separated by a short silence) and each one
+    is passed as its own clip, so BatchedInferencePipeline decodes them as one
+    batch instead of one transcribe() per utterance.
+
+    Args:
+        whisper_model: Loaded WhisperModel
+        audios (list): WAV paths, file-like objects or 16 kHz float32 arrays (each < 30 s)
+        language (str, optional): Whisper language code, None to auto-detect
+        batch_size (int): Max utterances decoded together
+        batched_pipeline (optional): Reuse an existing BatchedInferencePipeline
+
+    Returns:
+        list: One transcript (str) per input utterance, in order
+    """
+    if not audios:
+        return []
+
+    try:
+        from faster_whisper import BatchedInferencePipeline
+    except ImportError:
+        BatchedInferencePipeline = None
+
+    arrays = [_load_audio(a) for a in audios]
+
+    if BatchedInferencePipeline is None or len(arrays) == 1:
+        # Older faster-whisper (or nothing to batch): one call per utterance
+        results = []
+        for arr in arrays:
+            duration_s = len(arr) / WHISPER_SAMPLE_RATE
+            segments, _ = whisper_model.transcribe(
+                arr, **transcribe_kwargs(language, trusted_segmentation=True, duration_s=duration_s))
+            results.append(collect_text(segments, duration_s, language))
+        return results
+
+    # One token budget for the whole batch: sized for its longest utterance
+    longest_s = max(len(a) for a in arrays) / WHISPER_SAMPLE_RATE
+    kwargs = transcribe_kwargs(language, trusted_segmentation=True, duration_s=longest_s)
+
+    pipeline = batched_pipeline or BatchedInferencePipeline(model=whisper_model)
+
+    gap = np.zeros(int(CLIP_GAP_S * WHISPER_SAMPLE_RATE), dtype=np.float32)
+    parts, clips, offset = [], [], 0
+    for arr in arrays:
+        start = offset / WHISPER_SAMPLE_RATE
+        end = (offset + len(arr)) / WHISPER_SAMPLE_RATE
+        clips.append({"start": start, "end": end})
+        parts.extend([arr, gap])
+        offset += len(arr) + len(gap)
+    joined = np.concatenate(parts)
+
+    segments, _ = pipeline.transcribe(
+        joined,
+        batch_size=max(1, min(batch_size, len(arrays))),
+        clip_timestamps=clips,
+        without_timestamps=True,
+        **kwargs
+    )
+
+    texts = [[] for _ in arrays]
+    clip_tokens = {}
+    for seg in segments:
+        mid = (seg.start + seg.end) / 2
+        clip_index = next((i for i, clip in enumerate(clips)
+                           if clip["start"] - CLIP_GAP_S / 2 <= mid <= clip["end"] + CLIP_GAP_S / 2), None)
+        clip_tokens[clip_index] = clip_tokens.get(clip_index, 0) + len(getattr(seg, "tokens", None) or [])
+        reason = reject_reason(seg)
+        if reason:
+            metrics.inc(f"asr.rejected_segments.{reason}")
+            continue
+        if clip_index is not None:
+            texts[clip_index].append(seg.text.strip())
+    count_truncated(clip_tokens, kwargs.get("max_new_tokens"))
+    return [" ".join(t).strip() for t in texts]
+
+
+class ASRQueue:
+    """Queue that groups pending utterances and transcribes them in batches"""
+
+    def __init__(self, whisper_model, language: Optional[str] = None,
+                 max_batch: int = MAX_BATCH_SIZE, wait_ms: int = BATCH_WAIT_MS):
+        """
+        Start the background transcription worker
+
+        Args:
+            whisper_model: Loaded WhisperModel
+            language (str, optional): Whisper language code, None to auto-detect
+            max_batch (int): Max utterances per batched call
+            wait_ms (int): Time to wait for more utterances before decoding a batch
+        """
+        self.whisper_model = whisper_model
+        self.language = language
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self._queue = queue.Queue()
+        self._batched_pipeline = None
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, audio):
+        """
+        Queue an utterance for transcription
+
+        Args:
+            audio: WAV path, file-like object or 16 kHz float32 array
+
+        Returns:
+            concurrent.futures.Future: Resolves to the transcript (str)
+        """
+        future = Future()
+        self._queue.put((audio, future))
+        return future
+
+    def pending(self) -> int:
+        """Number of utterances waiting to be transcribed"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Stop the worker after the current batch"""
+        self._stop.set()
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def _next_batch(self) -> list:
+        item = self._queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.time() + self.wait_ms / 1000
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._stop.set()
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                break
+            audios = [audio for audio, _ in batch]
+            try:
+                if self._batched_pipeline is None:
+                    try:
+                        from faster_whisper import BatchedInferencePipeline
+                        self._batched_pipeline = BatchedInferencePipeline(model=self.whisper_model)
+                    except ImportError:
+                        pass
+                texts = transcribe_batch(self.whisper_model, audios, self.language,
+                                         batch_size=self.max_batch,
+                                         batched_pipeline=self._batched_pipeline)
+                logger.info(f"ASR batch of {len(batch)} utterance(s) transcribed")
+                for (_, future), text in zip(batch, texts):
+                    future.set_result(text)
+            except Exception as e:
+                logger.error(f"Batched transcription error: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+def batch_throughput(whisper_model, wav_paths: list, language: Optional[str] = None,
+                     batch_sizes=(1, 2, 4, 8)) -> dict:
+    """
+    Measure batched transcription throughput in audio-seconds per CPU-second
+
+    Args:
+        whisper_model: Loaded WhisperModel
+        wav_paths (list): Utterance WAV files to transcribe
+        language (str, optional): Whisper language code
+        batch_sizes (tuple): Batch sizes to compare
+
+    Returns:
+        dict: {batch_size: {"audio_s", "cpu_s", "wall_s", "audio_s_per_cpu_s"}}
+    """
+    arrays = [_load_audio(p) for p in wav_paths]
+    audio_s = sum(len(a) for a in arrays) / WHISPER_SAMPLE_RATE
+
+    results = {}
+    for size in batch_sizes:
+        cpu_start = time.process_time()
+        wall_start = time.time()
+        for i in range(0, len(arrays), size):
+            transcribe_batch(whisper_model, arrays[i:i + size], language, batch_size=size)
+        cpu_s = time.process_time() - cpu_start
+        results[size] = {
+            "audio_s": audio_s,
+            "cpu_s": cpu_s,
+            "wall_s": time.time() - wall_start,
+            "audio_s_per_cpu_s": audio_s / cpu_s if cpu_s > 0 else 0.0,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 whisper_asr.py <wav-dir> [model] [language]")
+        sys.exit(1)
+
+    from faster_whisper import WhisperModel
+
+    wav_dir = Path(sys.argv[1])
+    model_name = sys.argv[2] if len(sys.argv) > 2 else "small"
+    lang = sys.argv[3] if len(sys.argv) > 3 else None
+    wavs = sorted(str(p) for p in wav_dir.glob("*.wav"))
+    if not wavs:
+        print(f"❌ No WAV files in {wav_dir}")
+        sys.exit(1)
+
+    model = WhisperModel(model_name, device="cpu", compute_type="int8", cpu_threads=4,
+                         download_root=str(Path.home() / ".cache" / "whisper"))
+    print(f"🏃 Batched ASR throughput: {model_name}, {len(wavs)} utterances")
+    print("-" * 50)
+    for size, r in batch_throughput(model, wavs, lang).items():
+        print(f"batch {size:2d} | audio {r['audio_s']:6.1f}s | cpu {r['cpu_s']:6.1f}s | "
+              f"{r['audio_s_per_cpu_s']:5.2f} audio-s/cpu-s")